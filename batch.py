@@ -0,0 +1,196 @@
+"""Tailor one resume against many job descriptions concurrently.
+
+Usage:
+    python batch.py --resume default_resume.txt --jobs postings/ --out tailored.zip
+
+Job descriptions are read from `.txt`/`.md` files (or directories of them).
+API keys come from RESUME_API_KEYS or GOOGLE_API_KEY and are used through
+the rate-limited key pool (see key_pool.py).
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Optional
+
+from compile_cache import CompileCache
+from generation_cache import default_generation_cache
+from key_pool import ApiKeyPool
+from latex_compiler import CompileEngine
+from pipeline import GenerationRequest, ResumePipeline
+from prompts import MODEL_NAME
+
+# --- Configuration ---
+DEFAULT_CONCURRENCY = 4
+RATE_LIMIT_RETRIES = 5
+JOB_FILE_EXTENSIONS = (".txt", ".md")
+
+
+@dataclass
+class BatchJob:
+    name: str
+    job_description: str
+
+
+@dataclass
+class BatchResult:
+    name: str
+    tex_code: Optional[str] = None
+    pdf_bytes: Optional[bytes] = None
+    change_summary: Optional[str] = None
+    attempts: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def succeeded(self):
+        return self.pdf_bytes is not None
+
+
+def load_job_descriptions(paths):
+    """Read job descriptions from files and/or directories of `.txt`/`.md` files."""
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(JOB_FILE_EXTENSIONS)
+            )
+        else:
+            files = [path]
+        for file_path in files:
+            with open(file_path, "r") as f:
+                text = f.read().strip()
+            if text:
+                jobs.append(BatchJob(os.path.splitext(os.path.basename(file_path))[0], text))
+    return jobs
+
+
+def tailor_resume(pipeline, tex_code, job, summary_requested=False, api_key=None):
+    """Run the full generation pipeline for one job description."""
+    started = time.perf_counter()
+    generation = pipeline.run(GenerationRequest(tex_code, job.job_description, summary_requested), api_key=api_key)
+    return BatchResult(
+        job.name,
+        tex_code=generation.tex_code,
+        pdf_bytes=generation.pdf_bytes,
+        change_summary=generation.change_summary,
+        attempts=generation.attempts,
+        seconds=time.perf_counter() - started,
+        error=generation.error,
+    )
+
+
+def iter_batch(tex_code, jobs, compile_engine, generation_cache=None, summary_requested=False,
+               max_concurrency=DEFAULT_CONCURRENCY, model_name=MODEL_NAME, metrics=None, api_key=None, key_pool=None):
+    """Yield a BatchResult per job as each finishes, with at most `max_concurrency` Gemini calls in flight.
+
+    Gemini calls use `api_key` (a user's own key), else a key leased from
+    `key_pool`, else the configured key. Results are yielded on the caller's
+    thread, so UI progress updates are safe.
+    """
+    # Unlike the interactive app, a batch waits out rate limits instead of failing
+    pipeline = ResumePipeline(compile_engine, generation_cache, model_name=model_name,
+                              rate_limit_retries=RATE_LIMIT_RETRIES, metrics=metrics, key_pool=key_pool)
+
+    def run(job):
+        started = time.perf_counter()
+        try:
+            return tailor_resume(pipeline, tex_code, job, summary_requested, api_key)
+        except Exception as e:
+            return BatchResult(job.name, seconds=time.perf_counter() - started, error=f"{type(e).__name__}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch") as executor:
+        futures = [executor.submit(run, job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _safe_name(name, used):
+    base = re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("_") or "job"
+    candidate = base
+    counter = 2
+    while candidate in used:
+        candidate = f"{base}_{counter}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def build_zip(results):
+    """Zip the tailored PDFs and LaTeX sources with a CSV + JSON report of every job."""
+    buffer = io.BytesIO()
+    used = set()
+    report_rows = []
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for result in sorted(results, key=lambda r: r.name):
+            file_name = _safe_name(result.name, used)
+            if result.pdf_bytes:
+                archive.writestr(f"pdf/{file_name}.pdf", result.pdf_bytes)
+            if result.tex_code:
+                archive.writestr(f"tex/{file_name}.tex", result.tex_code)
+            report_rows.append({
+                "job": result.name,
+                "file": f"pdf/{file_name}.pdf" if result.pdf_bytes else "",
+                "status": "ok" if result.succeeded else "failed",
+                "attempts": result.attempts,
+                "seconds": round(result.seconds, 2),
+                "error": result.error or "",
+                "summary": result.change_summary or "",
+            })
+
+        csv_buffer = io.StringIO()
+        writer = csv.DictWriter(csv_buffer, fieldnames=list(report_rows[0].keys()) if report_rows else ["job"])
+        writer.writeheader()
+        writer.writerows(report_rows)
+        archive.writestr("report.csv", csv_buffer.getvalue())
+        archive.writestr("report.json", json.dumps(report_rows, indent=2))
+    return buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tailor one LaTeX resume to many job descriptions.")
+    parser.add_argument("--resume", default="default_resume.txt", help="LaTeX resume to tailor")
+    parser.add_argument("--jobs", nargs="+", required=True, help="Job description files or directories")
+    parser.add_argument("--out", default="tailored_resumes.zip", help="Output zip path")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Concurrent Gemini calls")
+    parser.add_argument("--compile-workers", type=int, default=DEFAULT_CONCURRENCY, help="Parallel pdflatex processes")
+    parser.add_argument("--summary", action="store_true", help="Ask Gemini for a summary of changes per job")
+    args = parser.parse_args(argv)
+
+    key_pool = ApiKeyPool.from_env()
+    if key_pool is None:
+        parser.error("Neither RESUME_API_KEYS nor GOOGLE_API_KEY is set.")
+    with open(args.resume, "r") as f:
+        tex_code = f.read()
+    jobs = load_job_descriptions(args.jobs)
+    if not jobs:
+        parser.error("No job descriptions found.")
+
+    compile_engine = CompileEngine(cache=CompileCache(), max_workers=args.compile_workers)
+    results = []
+    try:
+        for result in iter_batch(tex_code, jobs, compile_engine, default_generation_cache(),
+                                 args.summary, args.concurrency, key_pool=key_pool):
+            results.append(result)
+            status = "ok" if result.succeeded else f"FAILED ({result.error})"
+            print(f"[{len(results)}/{len(jobs)}] {result.name}: {status} in {result.seconds:.1f}s", file=sys.stderr)
+    finally:
+        compile_engine.shutdown()
+
+    with open(args.out, "wb") as f:
+        f.write(build_zip(results))
+    failed = sum(1 for result in results if not result.succeeded)
+    print(f"Wrote {args.out}: {len(results) - failed} succeeded, {failed} failed.", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""Offline throughput/latency benchmark of the generation pipeline.
+
+Usage:
+    python benchmark.py --runs 20 --concurrency 1 2 4 --latency 1.5 --broken-rate 0.2 --json bench.json
+
+Gemini is replaced by `FakeGenerativeModel`, which replays recorded responses
+(`--responses DIR`) or echoes the input resume back, with configurable latency.
+A share of first-attempt responses is deliberately broken so the local fixer,
+targeted repair and retry loop are exercised. Compiles use the real pdflatex,
+so results depend on the local TeX installation. No API key is needed.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from compile_cache import CompileCache
+from latex_compiler import CompileEngine, FormatCache
+from metrics import MetricsRecorder
+from pdf_preview import THUMBNAIL_DPI, PreviewCache
+from pipeline import GenerationRequest, ResumePipeline
+from compaction import PREAMBLE_PLACEHOLDER
+from response_parser import SUMMARY_SEPARATOR
+
+# --- Configuration ---
+DEFAULT_RUNS = 20
+DEFAULT_CONCURRENCY = (1, 2, 4)
+DEFAULT_LATENCY = 1.0 # Seconds per simulated Gemini call
+DEFAULT_JITTER = 0.25 # Fraction of the latency, applied uniformly +/-
+DEFAULT_BROKEN_RATE = 0.2
+DEFAULT_REPAIR_RATE = 0.5
+STREAM_CHUNK_CHARS = 200
+# Fatal under -interaction=nonstopmode (no PDF is written), unlike e.g. an undefined macro
+BROKEN_LINE = "\\input{benchmark-missing-file}"
+RESUME_PART_MARKER = "**Input Resume LaTeX Code:**"
+RETRY_MARKER = "**Previous Attempt Error:**"
+REPAIR_MARKER = "### LINES "
+SECTION_MARKER = "### SECTION "
+
+SYNTHETIC_JOBS = [
+    "Data Analyst. Requirements: SQL, Python, Power BI, stakeholder reporting, A/B testing.",
+    "Machine Learning Engineer. Requirements: PyTorch, model deployment, MLOps, feature stores, AWS.",
+    "Business Intelligence Developer. Requirements: Tableau, ETL pipelines, data warehousing, dbt.",
+    "Marketing Analyst. Requirements: Google Analytics, campaign attribution, Excel, SQL, storytelling.",
+    "Data Scientist. Requirements: statistics, experimentation, NLP, scikit-learn, communication.",
+]
+
+
+# --- Fake Gemini ---
+def _fraction(*parts):
+    """Deterministic value in [0, 1) for the given parts, so runs are reproducible."""
+    digest = hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+class FakeGenerativeModel:
+    """Stand-in for `genai.GenerativeModel` that never touches the network.
+
+    Without `responses`, a generation prompt is answered with the input resume
+    itself (plus a summary when one was requested). With `responses`, the
+    recorded texts are replayed round-robin. `broken_rate` of first attempts
+    get an `\\input` of a missing file inserted, which stops pdflatex; retries with error context are always
+    clean, and `repair_rate` of targeted-repair prompts are answered with a
+    correct patch (the rest get an empty answer, forcing a full retry).
+    """
+
+    def __init__(self, model_name="fake", latency=DEFAULT_LATENCY, jitter=DEFAULT_JITTER, responses=None,
+                 broken_rate=DEFAULT_BROKEN_RATE, repair_rate=DEFAULT_REPAIR_RATE, seed=0):
+        self.model_name = model_name
+        self.latency = latency
+        self.jitter = jitter
+        self.broken_rate = broken_rate
+        self.repair_rate = repair_rate
+        self.seed = seed
+        self._responses = itertools.cycle(responses) if responses else None
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.broken = 0 # Responses with BROKEN_LINE injected
+
+    def __call__(self, model_name):
+        # Lets one instance serve as ResumePipeline's `model_factory`
+        return self
+
+    def _delay(self):
+        with self._lock:
+            self.calls += 1
+            spread = self._rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency * (1 + spread))
+
+    def _answer(self, prompt_text, parts, variation=None):
+        if REPAIR_MARKER in prompt_text:
+            if _fraction(self.seed, "repair", prompt_text) >= self.repair_rate:
+                return ""
+            blocks = [part for part in parts if isinstance(part, str) and part.startswith(REPAIR_MARKER)]
+            return "\n".join(block.replace(BROKEN_LINE, "") for block in blocks)
+
+        if SECTION_MARKER in prompt_text:
+            # Incremental regeneration: echo the sections back unchanged
+            blocks = [part for part in parts if isinstance(part, str) and part.startswith(SECTION_MARKER)]
+            return "\n".join(blocks)
+
+        if self._responses is not None:
+            with self._lock:
+                return next(self._responses)
+
+        tex_code = ""
+        for index, part in enumerate(parts):
+            if isinstance(part, str) and RESUME_PART_MARKER in part and index + 1 < len(parts):
+                tex_code = parts[index + 1]
+                break
+        if RETRY_MARKER not in prompt_text and _fraction(self.seed, "broken", prompt_text, variation) < self.broken_rate:
+            # Compacted prompts carry a placeholder instead of the preamble
+            marker = "\\begin{document}" if "\\begin{document}" in tex_code else PREAMBLE_PLACEHOLDER
+            tex_code = tex_code.replace(marker, marker + "\n" + BROKEN_LINE, 1)
+            with self._lock:
+                self.broken += 1
+        text = f"```latex\n{tex_code}\n```"
+        if SUMMARY_SEPARATOR in prompt_text:
+            text += f"\n{SUMMARY_SEPARATOR}\n- Tailored keywords to the job description (benchmark)."
+        return text
+
+    def generate_content(self, parts, stream=False, **kwargs):
+        prompt_text = "\n".join(part for part in parts if isinstance(part, str))
+        # Speculative candidates differ only in generation_config, so it decides brokenness too
+        text = self._answer(prompt_text, parts, kwargs.get("generation_config"))
+        usage = SimpleNamespace(prompt_token_count=len(prompt_text) // 4, candidates_token_count=len(text) // 4)
+        delay = self._delay()
+        if not stream:
+            time.sleep(delay)
+            return SimpleNamespace(text=text, prompt_feedback=None, usage_metadata=usage)
+        return _FakeStream(text, delay, usage)
+
+
+class _FakeStream:
+    """Streamed response: chunks arrive evenly over the simulated latency."""
+
+    def __init__(self, text, delay, usage):
+        self.text = text
+        self.prompt_feedback = None
+        self.usage_metadata = usage
+        self._delay = delay
+
+    def __iter__(self):
+        chunks = [self.text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(self.text), STREAM_CHUNK_CHARS)] or [""]
+        for chunk in chunks:
+            time.sleep(self._delay / len(chunks))
+            yield SimpleNamespace(text=chunk)
+
+
+# --- Inputs ---
+def resume_variants(tex_code, count):
+    """The resume plus `count - 1` variants that differ in length and content, so compiles are not all cache hits."""
+    variants = [tex_code]
+    item_lines = [line for line in tex_code.split("\n") if line.strip().startswith("\\resumeItem{")]
+    for index in range(1, count):
+        variant = tex_code
+        # Grow the document a little more with each variant
+        for line in item_lines[:index % 4]:
+            variant = variant.replace(line, f"{line}\n{line}", 1)
+        variant = variant.replace("\\end{document}", f"% benchmark variant {index}\n\\end{{document}}", 1)
+        variants.append(variant)
+    return variants
+
+
+def load_responses(directory):
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith((".txt", ".md", ".tex")))
+    responses = []
+    for name in names:
+        with open(os.path.join(directory, name), "r") as f:
+            responses.append(f.read())
+    return responses
+
+
+# --- Measurement ---
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _summarize(values):
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "mean": statistics.fmean(values) if values else None,
+    }
+
+
+def run_level(concurrency, runs, variants, fake_model, format_cache, stream=False, compile_workers=None, candidates=1,
+              compact_prompt=True):
+    """Run `runs` requests with `concurrency` in flight against fresh compile/preview caches."""
+    metrics = MetricsRecorder(history=runs, file_path=None)
+    with tempfile.TemporaryDirectory(prefix="resume-bench-") as cache_dir:
+        compile_engine = CompileEngine(cache=CompileCache(cache_dir), format_cache=format_cache,
+                                       max_workers=compile_workers or concurrency)
+        pipeline = ResumePipeline(compile_engine, preview_cache=PreviewCache(), metrics=metrics,
+                                  model_factory=fake_model, retry_delay=0.0)
+
+        def one(index):
+            request = GenerationRequest(variants[index % len(variants)], SYNTHETIC_JOBS[index % len(SYNTHETIC_JOBS)],
+                                        candidates=candidates, compact_prompt=compact_prompt)
+            started = time.perf_counter()
+            result = pipeline.run(request, stream=stream)
+            latency = time.perf_counter() - started
+            preview_seconds, preview_error = None, None
+            if result.succeeded:
+                preview_started = time.perf_counter()
+                try:
+                    pipeline.preview_page(result.pdf_bytes, 0, THUMBNAIL_DPI)
+                    preview_seconds = time.perf_counter() - preview_started
+                except Exception as e:
+                    preview_error = f"{type(e).__name__}: {e}"
+            return result, latency, preview_seconds, preview_error
+
+        tracemalloc.start()
+        wall_started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as executor:
+                outcomes = list(executor.map(one, range(runs)))
+        finally:
+            wall_seconds = time.perf_counter() - wall_started
+            _, peak_bytes = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            compile_engine.shutdown()
+
+    compile_seconds = [
+        stage["seconds"] for run in metrics.recent_runs() for stage in run["stages"] if stage["stage"] == "compile"
+    ]
+    preview_errors = [error for _, _, _, error in outcomes if error]
+    return {
+        "concurrency": concurrency,
+        "runs": runs,
+        "succeeded": sum(1 for result, _, _, _ in outcomes if result.succeeded),
+        "wall_seconds": round(wall_seconds, 3),
+        "runs_per_second": round(runs / wall_seconds, 3) if wall_seconds else None,
+        "latency": _summarize([latency for _, latency, _, _ in outcomes]),
+        "compile": _summarize(compile_seconds),
+        "preview": _summarize([seconds for _, _, seconds, _ in outcomes if seconds is not None]),
+        "attempts_mean": statistics.fmean(result.attempts for result, _, _, _ in outcomes),
+        "python_peak_mb": round(peak_bytes / 2 ** 20, 2),
+        "preview_errors": preview_errors[:3],
+    }
+
+
+def check_recovery(level, candidates=1):
+    """Error message if injected breakages did not make the pipeline repair or retry, else None.
+
+    Each broken response must cost at least one extra model call (a targeted
+    repair or a full retry). With speculation a broken candidate can simply
+    lose to a clean one, so only single-candidate runs are checked.
+    """
+    if candidates > 1 or not level.get("broken_injected"):
+        return None
+    if level["model_calls"] < level["runs"] + level["broken_injected"]:
+        return (f"concurrency {level['concurrency']}: {level['broken_injected']} broken response(s) injected but only "
+                f"{level['model_calls']} model calls for {level['runs']} runs; repair/retry did not run")
+    return None
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value:.3f}"
+
+
+def print_report(levels, out=sys.stdout):
+    header = (f"{'conc':>4} {'ok':>7} {'runs/s':>7} {'lat p50':>8} {'lat p95':>8} "
+              f"{'cmp p50':>8} {'cmp p95':>8} {'prv p50':>8} {'prv p95':>8} {'attempts':>8} {'py MB':>7}")
+    print(header, file=out)
+    for level in levels:
+        print(
+            f"{level['concurrency']:>4} {level['succeeded']:>3}/{level['runs']:<3} {level['runs_per_second']:>7.2f} "
+            f"{_format_seconds(level['latency']['p50']):>8} {_format_seconds(level['latency']['p95']):>8} "
+            f"{_format_seconds(level['compile']['p50']):>8} {_format_seconds(level['compile']['p95']):>8} "
+            f"{_format_seconds(level['preview']['p50']):>8} {_format_seconds(level['preview']['p95']):>8} "
+            f"{level['attempts_mean']:>8.2f} {level['python_peak_mb']:>7.1f}",
+            file=out,
+        )
+        for error in level["preview_errors"]:
+            print(f"     preview failed: {error}", file=out)
+    # ru_maxrss is in kilobytes on Linux
+    usage_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    print(f"Peak RSS: {usage_self / 1024:.1f} MB (this process), {usage_children / 1024:.1f} MB (largest pdflatex)", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline offline against a fake Gemini.")
+    parser.add_argument("--resume", default="default_resume.txt", help="LaTeX resume used as the base input")
+    parser.add_argument("--variants", type=int, default=5, help="Number of distinct resume variants")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(DEFAULT_CONCURRENCY), help="Concurrency levels")
+    parser.add_argument("--compile-workers", type=int, default=None, help="pdflatex workers (default: the concurrency level)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="Simulated Gemini latency in seconds")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER, help="Latency jitter as a fraction")
+    parser.add_argument("--broken-rate", type=float, default=DEFAULT_BROKEN_RATE, help="Share of broken first attempts")
+    parser.add_argument("--repair-rate", type=float, default=DEFAULT_REPAIR_RATE, help="Share of repair prompts answered correctly")
+    parser.add_argument("--responses", help="Directory of recorded responses to replay instead of echoing the input")
+    parser.add_argument("--stream", action="store_true", help="Use the streaming code path")
+    parser.add_argument("--candidates", type=int, default=1, help="Speculative candidates per request")
+    parser.add_argument("--no-compact", action="store_true", help="Send the resume to the model uncompacted")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    # The report is printed to stdout; keep the per-run JSON lines out of it
+    logging.getLogger("resume_improv.metrics").setLevel(logging.WARNING)
+
+    with open(args.resume, "r") as f:
+        variants = resume_variants(f.read(), max(1, args.variants))
+    responses = load_responses(args.responses) if args.responses else None
+
+    levels = []
+    with tempfile.TemporaryDirectory(prefix="resume-bench-fmt-") as format_dir:
+        # Formats are shared across levels: the first level pays for dumping them, like a fresh server would
+        format_cache = FormatCache(format_dir)
+        for concurrency in args.concurrency:
+            fake_model = FakeGenerativeModel(latency=args.latency, jitter=args.jitter, responses=responses,
+                                             broken_rate=args.broken_rate, repair_rate=args.repair_rate, seed=args.seed)
+            print(f"Running {args.runs} requests at concurrency {concurrency}...", file=sys.stderr)
+            level = run_level(concurrency, args.runs, variants, fake_model, format_cache, args.stream, args.compile_workers,
+                              args.candidates, not args.no_compact)
+            level["model_calls"] = fake_model.calls
+            level["broken_injected"] = fake_model.broken
+            levels.append(level)
+
+    print_report(levels)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"config": vars(args), "levels": levels}, f, indent=2)
+    problems = [problem for level in levels for problem in [check_recovery(level, args.candidates)] if problem]
+    for problem in problems:
+        print(f"ERROR: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
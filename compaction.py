@@ -0,0 +1,146 @@
+"""Reversible prompt compaction for LaTeX sent to Gemini.
+
+Comments and redundant whitespace are removed from the document body, the
+preamble is replaced by a placeholder line, and anything after
+`\end{document}` (which TeX ignores) is dropped. `restore_latex` puts the
+original preamble and trailing text back after the response arrives. Token counts are estimated
+at ~4 characters per token, which is close enough to compare before/after.
+"""
+import re
+from dataclasses import dataclass
+
+from response_parser import END_DOCUMENT
+from sections import BEGIN_DOCUMENT, macro_signatures
+
+PREAMBLE_PLACEHOLDER = "%%PREAMBLE%%"
+CHARS_PER_TOKEN = 4
+DOCUMENT_CLASS = "\\documentclass"
+
+_VERBATIM_BEGIN = re.compile(r"\\begin\{(verbatim|lstlisting|minted)\*?\}")
+_URL_WITH_PERCENT = re.compile(r"\\(?:url|href)\{[^}]*%")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+@dataclass
+class CompactionReport:
+    original_tokens: int # Estimated
+    compacted_tokens: int
+
+    @property
+    def saved_tokens(self):
+        return self.original_tokens - self.compacted_tokens
+
+    @property
+    def saved_ratio(self):
+        return self.saved_tokens / self.original_tokens if self.original_tokens else 0.0
+
+
+@dataclass
+class CompactedLatex:
+    text: str
+    preamble: str # Original preamble through \begin{document}; "" when not replaced
+    trailer: str # Original text after \end{document}
+    report: CompactionReport
+
+
+def _comment_start(line):
+    """Index of the first unescaped `%` in `line`, or -1."""
+    index = line.find("%")
+    while index != -1:
+        backslashes = 0
+        while index - backslashes - 1 >= 0 and line[index - backslashes - 1] == "\\":
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return index
+        index = line.find("%", index + 1)
+    return -1
+
+
+def strip_comments_and_whitespace(tex_code):
+    """Drop comments, indentation, trailing spaces and extra blank lines without changing the output.
+
+    A comment directly after text keeps its `%`, since that suppresses the
+    end-of-line space. Verbatim-like environments and lines with a `%` inside
+    a URL are left untouched.
+    """
+    lines = []
+    verbatim_end = None
+    for line in tex_code.split("\n"):
+        if verbatim_end is not None:
+            lines.append(line)
+            if verbatim_end in line:
+                verbatim_end = None
+            continue
+        match = _VERBATIM_BEGIN.search(line)
+        if match:
+            verbatim_end = f"\\end{{{match.group(1)}}}"
+            lines.append(line)
+            continue
+        if _URL_WITH_PERCENT.search(line):
+            lines.append(line.rstrip())
+            continue
+
+        comment = _comment_start(line)
+        if comment != -1:
+            before = line[:comment]
+            if not before.strip():
+                continue # Whole-line comment
+            line = before + "%" if not before[-1].isspace() else before.rstrip()
+        # TeX skips leading spaces on a line anyway
+        lines.append(line.strip())
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip() + "\n"
+
+
+def compact_latex(tex_code, replace_preamble=True):
+    """Compact a full document for the prompt. Returns a CompactedLatex."""
+    preamble, body, trailer = "", tex_code, ""
+    begin = tex_code.find(BEGIN_DOCUMENT)
+    if replace_preamble and begin != -1 and DOCUMENT_CLASS in tex_code[:begin]:
+        preamble = tex_code[:begin + len(BEGIN_DOCUMENT)]
+        body = tex_code[begin + len(BEGIN_DOCUMENT):]
+    end = body.find(END_DOCUMENT)
+    if end != -1:
+        body, trailer = body[:end + len(END_DOCUMENT)], body[end + len(END_DOCUMENT):]
+    text = strip_comments_and_whitespace(body)
+    if preamble:
+        text = f"{PREAMBLE_PLACEHOLDER}\n{text}"
+    return CompactedLatex(text, preamble, trailer, CompactionReport(estimate_tokens(tex_code), estimate_tokens(text)))
+
+
+def preamble_note(preamble):
+    """Prompt instructions that explain the placeholder, with the custom macros it defines."""
+    note = (
+        f"\n**Note:** The preamble (everything up to and including `\\begin{{document}}`) was replaced by the line "
+        f"`{PREAMBLE_PLACEHOLDER}` to save space. Keep that line unchanged as the first line of your LaTeX output, "
+        f"do not write a preamble or `\\begin{{document}}`, and do not use packages that are not already loaded."
+    )
+    macros = macro_signatures(preamble)
+    if macros:
+        note += " Custom macros available: " + ", ".join(macros) + "."
+    return note
+
+
+def restore_latex(tex_code, compacted):
+    """Put the original preamble and trailing text back into a response to a compacted prompt."""
+    if compacted.trailer.strip() and tex_code.rstrip().endswith(END_DOCUMENT):
+        tex_code = tex_code.rstrip() + compacted.trailer
+    return _restore_preamble(tex_code, compacted.preamble)
+
+
+def _restore_preamble(tex_code, preamble):
+    if not preamble:
+        return tex_code
+    if PREAMBLE_PLACEHOLDER in tex_code:
+        body = tex_code.split(PREAMBLE_PLACEHOLDER, 1)[1]
+    elif DOCUMENT_CLASS in tex_code:
+        return tex_code # Gemini wrote its own preamble anyway
+    else:
+        body = tex_code
+    begin = body.find(BEGIN_DOCUMENT)
+    if begin != -1 and not body[:begin].strip():
+        body = body[begin + len(BEGIN_DOCUMENT):]
+    return preamble + "\n" + body.lstrip("\n")
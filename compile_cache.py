@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+# --- Configuration ---
+DEFAULT_CACHE_DIR = os.getenv(
+    "RESUME_COMPILE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "resume_improv_compile_cache"),
+)
+DEFAULT_MAX_BYTES = int(os.getenv("RESUME_COMPILE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+_toolchain_version = None
+
+
+def get_toolchain_version():
+    """Return the first line of `pdflatex --version`, looked up once per process."""
+    global _toolchain_version
+    if _toolchain_version is None:
+        try:
+            result = subprocess.run(["pdflatex", "--version"], capture_output=True, text=True, check=False)
+            lines = result.stdout.splitlines()
+            _toolchain_version = lines[0].strip() if lines else "unknown"
+        except OSError:
+            _toolchain_version = "unavailable"
+    return _toolchain_version
+
+
+def cache_key(tex_code, toolchain_version=None):
+    """Content address for a compile: the LaTeX source plus the TeX toolchain version."""
+    if toolchain_version is None:
+        toolchain_version = get_toolchain_version()
+    digest = hashlib.sha256()
+    digest.update(toolchain_version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(tex_code.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """On-disk cache of pdflatex results with size-bounded LRU eviction.
+
+    Each entry is a directory named after the cache key holding the PDF (if
+    one was produced), the pdflatex log and a small JSON file with the
+    captured stdout/stderr and return code. The entry's mtime is bumped on
+    every hit so eviction removes the least recently used entries first.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """Return the cached entry as a dict, or None on a miss."""
+        entry_dir = self._entry_dir(key)
+        meta_path = os.path.join(entry_dir, "meta.json")
+        try:
+            with open(meta_path, "r") as f:
+                entry = json.load(f)
+            pdf_bytes = None
+            if entry.get("has_pdf"):
+                with open(os.path.join(entry_dir, "resume.pdf"), "rb") as f:
+                    pdf_bytes = f.read()
+            log = ""
+            log_path = os.path.join(entry_dir, "resume.log")
+            if os.path.exists(log_path):
+                with open(log_path, "r", errors="replace") as f:
+                    log = f.read()
+        except (OSError, ValueError):
+            # Missing or half-written entry: treat as a miss
+            return None
+
+        # Mark as recently used
+        now = time.time()
+        try:
+            os.utime(entry_dir, (now, now))
+        except OSError:
+            pass
+
+        entry["pdf_bytes"] = pdf_bytes
+        entry["log"] = log
+        return entry
+
+    def put(self, key, pdf_bytes, stdout, stderr, returncode, log=""):
+        """Store a compile result. Writes go to a scratch dir and are renamed into place."""
+        staging_dir = tempfile.mkdtemp(prefix=".staging-", dir=self.cache_dir)
+        try:
+            if pdf_bytes is not None:
+                with open(os.path.join(staging_dir, "resume.pdf"), "wb") as f:
+                    f.write(pdf_bytes)
+            if log:
+                with open(os.path.join(staging_dir, "resume.log"), "w") as f:
+                    f.write(log)
+            with open(os.path.join(staging_dir, "meta.json"), "w") as f:
+                json.dump({
+                    "has_pdf": pdf_bytes is not None,
+                    "stdout": stdout or "",
+                    "stderr": stderr or "",
+                    "returncode": returncode,
+                    "created": time.time(),
+                }, f)
+
+            entry_dir = self._entry_dir(key)
+            with self._lock:
+                if os.path.exists(entry_dir):
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(staging_dir, entry_dir)
+                staging_dir = None
+                self._evict()
+        finally:
+            if staging_dir and os.path.exists(staging_dir):
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _entry_size(self, entry_dir):
+        total = 0
+        for name in os.listdir(entry_dir):
+            try:
+                total += os.path.getsize(os.path.join(entry_dir, name))
+            except OSError:
+                pass
+        return total
+
+    def _evict(self):
+        # Caller holds the lock
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.startswith("."):
+                continue
+            entry_dir = os.path.join(self.cache_dir, name)
+            try:
+                size = self._entry_size(entry_dir)
+                mtime = os.path.getmtime(entry_dir)
+            except OSError:
+                continue
+            entries.append((mtime, size, entry_dir))
+            total += size
+
+        # Oldest first
+        entries.sort()
+        while total > self.max_bytes and entries:
+            _, size, entry_dir = entries.pop(0)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            for name in os.listdir(self.cache_dir):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
@@ -0,0 +1,155 @@
+"""Post-compile exports built from a single pass over the PDF.
+
+The PDF is opened once to extract its text layer (as plain text and as
+Markdown, with headings inferred from font size) and to render a small
+first-page thumbnail. These artifacts depend only on the PDF, so they are
+cached by PDF hash; the ATS keyword match against a job description is
+cheap string work computed on top of the cached text.
+"""
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import fitz # PyMuPDF
+
+from pdf_preview import THUMBNAIL_DPI, pdf_hash
+
+# --- Configuration ---
+DEFAULT_MAX_ENTRIES = 64
+MAX_KEYWORDS = 30
+HEADING_SCALE = 1.15 # Lines this much larger than the body font become Markdown headings
+BULLETS = ("•", "·", "●", "○", "◦", "▪", "■", "–", "∙", "*", "-")
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9+#./-]*[A-Za-z0-9+#]|[A-Za-z]")
+STOPWORDS = frozenset("""
+a about above across after all also an and any are as at be been being both but by can could do does
+each either etc for from had has have having how if in including into is it its join may more most must
+new not of on or other our out over per plus should so some such than that the their them then there these
+they this those through to under up us use using various via was we well were what when where which while
+who will with within work working would you your years year experience team teams role ability strong
+need needs looking seeking required requirements preferred must-have must-haves nice-to-have candidate
+candidates responsibilities qualifications company
+""".split())
+
+
+@dataclass
+class PdfArtifacts:
+    digest: str
+    page_count: int
+    text: str
+    markdown: str
+    thumbnail_png: Optional[bytes] = None
+
+
+@dataclass
+class AtsMatch:
+    keywords: List[str] = field(default_factory=list)
+    matched: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+
+    @property
+    def score(self):
+        return len(self.matched) / len(self.keywords) if self.keywords else 0.0
+
+
+@dataclass
+class ExportBundle:
+    artifacts: PdfArtifacts
+    ats: AtsMatch
+
+
+def _normalize(word):
+    return word.lower().rstrip(".")
+
+
+def extract_keywords(job_description, limit=MAX_KEYWORDS):
+    """Most frequent non-stopword terms of the job description, first occurrence breaking ties."""
+    counts = Counter()
+    first_seen = {}
+    for index, match in enumerate(_WORD.finditer(job_description or "")):
+        word = _normalize(match.group(0))
+        if len(word) < 2 or word in STOPWORDS or word.isdigit():
+            continue
+        counts[word] += 1
+        first_seen.setdefault(word, index)
+    return sorted(counts, key=lambda word: (-counts[word], first_seen[word]))[:limit]
+
+
+def ats_match(text, job_description, limit=MAX_KEYWORDS):
+    """Which job-description keywords appear in the resume text, as an ATS would see them."""
+    keywords = extract_keywords(job_description, limit)
+    present = {_normalize(match.group(0)) for match in _WORD.finditer(text or "")}
+    matched = [keyword for keyword in keywords if keyword in present]
+    missing = [keyword for keyword in keywords if keyword not in present]
+    return AtsMatch(keywords, matched, missing)
+
+
+def _page_lines(page):
+    """(text, font size) per text line of a page, in reading order."""
+    lines = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            spans = [span for span in line["spans"] if span["text"].strip()]
+            if spans:
+                text = "".join(span["text"] for span in line["spans"]).strip()
+                lines.append((text, max(span["size"] for span in spans)))
+    return lines
+
+
+def _to_markdown(lines):
+    sizes = Counter()
+    for text, size in lines:
+        sizes[round(size, 1)] += len(text)
+    body_size = sizes.most_common(1)[0][0] if sizes else 0.0
+    largest = max(sizes, default=0.0)
+    markdown = []
+    for text, size in lines:
+        if body_size and size >= body_size * HEADING_SCALE:
+            markdown.append(("# " if round(size, 1) == largest else "## ") + text)
+        elif text.startswith(BULLETS):
+            markdown.append("- " + text.lstrip("".join(BULLETS)).strip())
+        else:
+            markdown.append(text)
+    return "\n".join(markdown) + "\n"
+
+
+def build_artifacts(pdf_bytes, thumbnail_dpi=THUMBNAIL_DPI, digest=None):
+    """Open the PDF once and extract everything the export stage needs."""
+    digest = digest or pdf_hash(pdf_bytes)
+    lines = []
+    thumbnail = None
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+        page_count = pdf_doc.page_count
+        for page_index in range(page_count):
+            page = pdf_doc.load_page(page_index)
+            if page_index == 0:
+                thumbnail = page.get_pixmap(dpi=thumbnail_dpi).tobytes("png")
+            lines.extend(_page_lines(page))
+    text = "\n".join(text for text, _ in lines) + "\n"
+    return PdfArtifacts(digest, page_count, text, _to_markdown(lines), thumbnail)
+
+
+class ExportCache:
+    """PdfArtifacts keyed by PDF hash, evicted LRU after `max_entries`."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, pdf_bytes, digest=None):
+        """Return (artifacts, built); `built` is False on a cache hit."""
+        digest = digest or pdf_hash(pdf_bytes)
+        with self._lock:
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+                return self._entries[digest], False
+
+        artifacts = build_artifacts(pdf_bytes, digest=digest)
+        with self._lock:
+            self._entries[digest] = artifacts
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return artifacts, True
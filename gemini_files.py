@@ -0,0 +1,132 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+import google.generativeai as genai
+
+from key_pool import using_key
+
+# --- Configuration ---
+FILE_LIFETIME_SECONDS = 48 * 60 * 60 # Gemini deletes uploaded files after 48 hours
+EXPIRY_MARGIN_SECONDS = 60 * 60 # Stop reusing a handle this long before it expires
+IDLE_TTL_SECONDS = int(os.getenv("RESUME_REMOTE_FILE_IDLE_TTL", 6 * 60 * 60))
+GC_INTERVAL_SECONDS = 10 * 60
+
+
+def upload_pdf_bytes(pdf_bytes, display_name):
+    """Upload PDF bytes straight from memory, falling back to a temp file on SDKs that need a path."""
+    try:
+        return genai.upload_file(path=io.BytesIO(pdf_bytes), display_name=display_name, mime_type='application/pdf')
+    except TypeError:
+        pass
+    temp_pdf_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_f:
+            temp_f.write(pdf_bytes)
+            temp_pdf_path = temp_f.name
+        return genai.upload_file(path=temp_pdf_path, display_name=display_name, mime_type='application/pdf')
+    finally:
+        if temp_pdf_path and os.path.exists(temp_pdf_path):
+            os.remove(temp_pdf_path)
+
+
+def _expires_at(remote_file, uploaded_at):
+    expiration = getattr(remote_file, "expiration_time", None)
+    if expiration is not None and hasattr(expiration, "timestamp"):
+        try:
+            return expiration.timestamp()
+        except (OverflowError, OSError, ValueError):
+            pass
+    return uploaded_at + FILE_LIFETIME_SECONDS
+
+
+class _Entry:
+    def __init__(self, remote_file, expires_at, api_key=None):
+        self.remote_file = remote_file
+        self.expires_at = expires_at
+        self.api_key = api_key # Files belong to the key's project, so it is also needed to delete them
+        self.last_used = time.time()
+
+
+class RemoteFileRegistry:
+    """Live Gemini file handles keyed by API key and PDF content hash.
+
+    The same instructions PDF is uploaded once and reused across requests
+    until shortly before Gemini expires it. A background thread deletes
+    handles that have gone unused for `idle_ttl` seconds or have expired.
+    Uploaded files belong to the API key that created them, so the key is
+    part of the registry key.
+    """
+
+    def __init__(self, idle_ttl=IDLE_TTL_SECONDS, gc_interval=GC_INTERVAL_SECONDS, start_gc=True):
+        self.idle_ttl = idle_ttl
+        self.gc_interval = gc_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._stop = threading.Event()
+        self._gc_thread = None
+        if start_gc:
+            self._gc_thread = threading.Thread(target=self._gc_loop, name="gemini-file-gc", daemon=True)
+            self._gc_thread.start()
+
+    def _registry_key(self, pdf_bytes, api_key):
+        key_fingerprint = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+        return key_fingerprint, hashlib.sha256(pdf_bytes).hexdigest()
+
+    def _is_live(self, entry, now):
+        return entry.expires_at - EXPIRY_MARGIN_SECONDS > now
+
+    def get_or_upload(self, pdf_bytes, display_name, api_key=None):
+        """Return (remote_file, reused) for `pdf_bytes`, uploading only if no live handle exists."""
+        registry_key = self._registry_key(pdf_bytes, api_key)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(registry_key, threading.Lock())
+
+        # Concurrent requests for the same PDF share one upload
+        with key_lock:
+            now = time.time()
+            with self._lock:
+                entry = self._entries.get(registry_key)
+                if entry is not None and self._is_live(entry, now):
+                    entry.last_used = now
+                    return entry.remote_file, True
+
+            with using_key(api_key):
+                remote_file = upload_pdf_bytes(pdf_bytes, display_name)
+            with self._lock:
+                self._entries[registry_key] = _Entry(remote_file, _expires_at(remote_file, now), api_key)
+            return remote_file, False
+
+    def collect(self):
+        """Drop expired or idle handles, deleting idle ones from Gemini. Returns the number dropped."""
+        now = time.time()
+        with self._lock:
+            stale = [
+                (registry_key, entry) for registry_key, entry in self._entries.items()
+                if not self._is_live(entry, now) or now - entry.last_used > self.idle_ttl
+            ]
+            for registry_key, _ in stale:
+                del self._entries[registry_key]
+                self._key_locks.pop(registry_key, None)
+
+        for _, entry in stale:
+            if entry.expires_at <= now:
+                continue # Already gone on Gemini's side
+            try:
+                with using_key(entry.api_key):
+                    genai.delete_file(entry.remote_file.name)
+            except Exception:
+                # Best effort: the file expires on its own within 48 hours
+                pass
+        return len(stale)
+
+    def _gc_loop(self):
+        while not self._stop.wait(self.gc_interval):
+            self.collect()
+
+    def shutdown(self):
+        self._stop.set()
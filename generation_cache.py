@@ -0,0 +1,161 @@
+import abc
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+# --- Configuration ---
+DEFAULT_DB_PATH = os.getenv(
+    "RESUME_GENERATION_CACHE_DB",
+    os.path.join(tempfile.gettempdir(), "resume_improv_generations.sqlite3"),
+)
+DEFAULT_TTL_SECONDS = int(os.getenv("RESUME_GENERATION_CACHE_TTL", 24 * 60 * 60))
+DEFAULT_MEMORY_ENTRIES = int(os.getenv("RESUME_GENERATION_CACHE_ENTRIES", 128))
+
+
+def _normalize_text(text):
+    # Line endings and trailing whitespace never change what Gemini is asked to do
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def pdf_content_hash(pdf_bytes):
+    if not pdf_bytes:
+        return None
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def generation_key(prompt_parts, model_name, pdf_hash=None):
+    """Hash of the normalized text prompt, the model name and the instructions PDF content.
+
+    Non-text prompt parts (the uploaded PDF) are represented by `pdf_hash`, so
+    the key does not depend on which remote file handle the PDF was uploaded as.
+    """
+    normalized = [
+        _normalize_text(part) if isinstance(part, str) else "<pdf>"
+        for part in prompt_parts
+    ]
+    payload = json.dumps({"model": model_name, "pdf": pdf_hash, "prompt": normalized})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GenerationCache(abc.ABC):
+    """Interface for response caches: map a generation key to the response text."""
+
+    @abc.abstractmethod
+    def lookup(self, key):
+        """(text, created) for a live entry, or None."""
+
+    @abc.abstractmethod
+    def set(self, key, text, created=None):
+        """Store `text`; `created` (epoch seconds) defaults to now and is what the TTL counts from."""
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """Forget `key`, e.g. because its response did not compile."""
+
+    def get(self, key):
+        entry = self.lookup(key)
+        return entry[0] if entry is not None else None
+
+
+class MemoryLRUCache(GenerationCache):
+    def __init__(self, max_entries=DEFAULT_MEMORY_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, text = entry
+            if time.time() - created > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return text, created
+
+    def set(self, key, text, created=None):
+        with self._lock:
+            self._entries[key] = (created if created is not None else time.time(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteCache(GenerationCache):
+    def __init__(self, db_path=DEFAULT_DB_PATH, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # A connection per call keeps this safe to share across Streamlit sessions/threads
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def lookup(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT text, created FROM generations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        text, created = row
+        if time.time() - created > self.ttl_seconds:
+            return None
+        return text, created
+
+    def set(self, key, text, created=None):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO generations (key, text, created) VALUES (?, ?, ?)",
+                (key, text, created if created is not None else time.time()),
+            )
+            conn.execute("DELETE FROM generations WHERE created < ?", (time.time() - self.ttl_seconds,))
+
+    def delete(self, key):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+
+
+class TieredCache(GenerationCache):
+    """Checks each tier in order; a hit in a slower tier is copied into the faster ones."""
+
+    def __init__(self, *tiers):
+        self.tiers = tiers
+
+    def lookup(self, key):
+        for index, tier in enumerate(self.tiers):
+            entry = tier.lookup(key)
+            if entry is not None:
+                # Keep the original creation time so the copy expires when the source does
+                for faster_tier in self.tiers[:index]:
+                    faster_tier.set(key, *entry)
+                return entry
+        return None
+
+    def set(self, key, text, created=None):
+        for tier in self.tiers:
+            tier.set(key, text, created)
+
+    def delete(self, key):
+        for tier in self.tiers:
+            tier.delete(key)
+
+
+def default_generation_cache():
+    return TieredCache(MemoryLRUCache(), SQLiteCache())
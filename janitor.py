@@ -0,0 +1,167 @@
+"""Cleanup that runs off the request path, and reusable compile scratch directories.
+
+`Janitor` is a single background thread that deletes per-run Gemini uploads
+and removes directories, so their latency never counts against a request.
+`ScratchPool` keeps a few pre-created working directories for pdflatex
+(on tmpfs when `/dev/shm` is available); a directory is emptied by the
+janitor after use and handed to the next compile instead of being created
+and deleted every time.
+"""
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import google.generativeai as genai
+
+from key_pool import using_key
+
+# --- Configuration ---
+TMPFS_DIR = "/dev/shm"
+DEFAULT_SCRATCH_ROOT = os.getenv(
+    "RESUME_SCRATCH_DIR",
+    os.path.join(TMPFS_DIR if os.access(TMPFS_DIR, os.W_OK) else tempfile.gettempdir(), "resume_improv_scratch"),
+)
+DEFAULT_POOL_SIZE = int(os.getenv("RESUME_SCRATCH_DIRS", os.getenv("RESUME_COMPILE_WORKERS", 2)))
+POOL_PREFIX = "pool-"
+
+
+class Janitor:
+    """Runs cleanup tasks in a background thread, in submission order.
+
+    Tasks are best effort: failures are counted, never raised. Without a
+    running thread (`start=False` or after `shutdown`) tasks run inline.
+    """
+
+    def __init__(self, start=True):
+        self.failures = 0
+        self._tasks = queue.Queue()
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._loop, name="janitor", daemon=True)
+            self._thread.start()
+
+    def submit(self, fn, *args):
+        if self._thread is None or not self._thread.is_alive():
+            self._run(fn, args)
+            return
+        self._tasks.put((fn, args))
+
+    def remove_tree(self, path):
+        self.submit(shutil.rmtree, path, True)
+
+    def delete_remote_file(self, name, api_key=None):
+        # Per-run upload, deleted with the key that uploaded it; an undeleted file still expires within 48 hours
+        self.submit(_delete_remote_file, name, api_key)
+
+    def drain(self):
+        """Block until every task submitted so far has run."""
+        if self._thread is not None and self._thread.is_alive():
+            self._tasks.join()
+
+    def shutdown(self, wait=True):
+        if self._thread is None:
+            return
+        self._tasks.put(None)
+        if wait:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self, fn, args):
+        try:
+            fn(*args)
+        except Exception:
+            self.failures += 1
+
+    def _loop(self):
+        while True:
+            task = self._tasks.get()
+            try:
+                if task is None:
+                    return
+                self._run(*task)
+            finally:
+                self._tasks.task_done()
+
+
+def _delete_remote_file(name, api_key):
+    with using_key(api_key):
+        genai.delete_file(name)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True # Exists but belongs to someone else
+    return True
+
+
+def _empty_directory(path):
+    for name in os.listdir(path):
+        entry = os.path.join(path, name)
+        if os.path.isdir(entry) and not os.path.islink(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            os.unlink(entry)
+
+
+class ScratchPool:
+    """Pre-created, reusable working directories for compiles.
+
+    Each process gets its own pool directory under `root`; pool directories
+    left behind by processes that no longer exist are removed at startup.
+    Up to `size` directories are kept; when all are in use, extra ones are
+    created on demand and removed after use.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, root=DEFAULT_SCRATCH_ROOT, janitor=None):
+        self.size = max(size, 0)
+        self.janitor = janitor if janitor is not None else Janitor(start=False)
+        os.makedirs(root, exist_ok=True)
+        self._sweep_orphans(root)
+        self.pool_dir = tempfile.mkdtemp(prefix=f"{POOL_PREFIX}{os.getpid()}-", dir=root)
+        self._lock = threading.Lock()
+        self._free = [tempfile.mkdtemp(dir=self.pool_dir) for _ in range(self.size)]
+
+    def _sweep_orphans(self, root):
+        for name in os.listdir(root):
+            if not name.startswith(POOL_PREFIX):
+                continue
+            pid = name[len(POOL_PREFIX):].split("-", 1)[0]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                self.janitor.remove_tree(os.path.join(root, name))
+
+    @contextmanager
+    def directory(self):
+        """An empty directory for one compile, returned to the pool afterwards."""
+        with self._lock:
+            path = self._free.pop() if self._free else None
+        if path is None or not os.path.isdir(path):
+            path = tempfile.mkdtemp(dir=self.pool_dir)
+        try:
+            yield path
+        finally:
+            self.janitor.submit(self._recycle, path)
+
+    def _recycle(self, path):
+        try:
+            _empty_directory(path)
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+            return
+        with self._lock:
+            keep = len(self._free) < self.size
+            if keep:
+                self._free.append(path)
+        if not keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def shutdown(self):
+        with self._lock:
+            self._free = []
+        shutil.rmtree(self.pool_dir, ignore_errors=True)
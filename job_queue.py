@@ -0,0 +1,522 @@
+"""Persistent generation job queue (SQLite) executed by a pool of worker processes.
+
+The Streamlit script only enqueues a job and polls its row; the pipeline runs
+in a worker process, so a browser refresh or script rerun does not lose the
+work. The number of workers caps concurrent Gemini/pdflatex work per node.
+Jobs whose worker stops heartbeating are requeued. A user's API key never
+reaches the database: it is handed to the workers in memory (`WorkerPool.api_keys`)
+and dropped when the job finishes, so a job whose key was lost to an app
+restart fails instead of running. The database lives in a directory only
+the app's user can read. Workers also record their run summaries and
+key pool headroom here, and `follow_runs` feeds those runs into the app's
+MetricsRecorder.
+"""
+import getpass
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Optional
+
+from compile_cache import CompileCache
+from gemini_files import RemoteFileRegistry
+from janitor import Janitor, ScratchPool
+from key_pool import ApiKeyPool
+from generation_cache import default_generation_cache
+from latex_compiler import CompileEngine, CompileResult
+from layout_check import LayoutReport
+from pipeline import GenerationRequest, GenerationResult, ResumePipeline
+
+# --- Configuration ---
+PRIVATE_DB_DIR = os.path.join(tempfile.gettempdir(), f"resume_improv-{getpass.getuser()}") # Mode 0700
+DEFAULT_DB_PATH = os.getenv("RESUME_JOB_DB", os.path.join(PRIVATE_DB_DIR, "jobs.sqlite3"))
+DEFAULT_WORKERS = int(os.getenv("RESUME_JOB_WORKERS", 2)) # 0 runs generations inside the Streamlit process
+POLL_INTERVAL_SECONDS = 0.5
+HEARTBEAT_SECONDS = 5
+STALE_AFTER_SECONDS = 60 # A running job without a heartbeat for this long is requeued
+MAX_CLAIMS = 3 # Give up on a job after this many workers died running it
+RETENTION_SECONDS = int(os.getenv("RESUME_JOB_RETENTION", 24 * 60 * 60))
+PURGE_INTERVAL_SECONDS = 10 * 60
+PARTIAL_TEXT_INTERVAL_SECONDS = 0.5 # Throttle for persisting streamed output
+RUN_POLL_SECONDS = 2 # How often the app picks up run summaries recorded by workers
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED_STATUSES = (SUCCEEDED, FAILED)
+_KEY_LOST = object() # `_claim_next` failed a job whose user key is gone
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL,
+    worker TEXT,
+    claims INTEGER NOT NULL DEFAULT 0,
+    user_key INTEGER NOT NULL DEFAULT 0,
+    stream INTEGER NOT NULL DEFAULT 0,
+    tex_input TEXT NOT NULL,
+    job_description TEXT NOT NULL,
+    summary_requested INTEGER NOT NULL,
+    instructions_pdf BLOB,
+    instructions_pdf_name TEXT,
+    force_regenerate INTEGER NOT NULL,
+    candidates INTEGER NOT NULL DEFAULT 1,
+    improved_tex_input TEXT,
+    regenerate_sections TEXT,
+    compact_prompt INTEGER NOT NULL DEFAULT 1,
+    max_pages INTEGER,
+    progress TEXT,
+    partial_text TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    tex_code TEXT,
+    pdf_bytes BLOB,
+    change_summary TEXT,
+    summary_missing INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    error_type TEXT,
+    compile_stdout TEXT,
+    compile_stderr TEXT,
+    compile_returncode INTEGER,
+    compile_log TEXT,
+    layout_json TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded REAL NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS worker_keys (
+    worker TEXT PRIMARY KEY,
+    updated REAL NOT NULL,
+    headroom TEXT NOT NULL
+);
+"""
+
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    created: float
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    progress: Optional[str] = None
+    partial_text: Optional[str] = None
+    attempts: int = 0
+    tex_code: Optional[str] = None
+    pdf_bytes: Optional[bytes] = None
+    change_summary: Optional[str] = None
+    summary_missing: bool = False
+    error: Optional[str] = None
+    error_type: Optional[str] = None # Exception class name when the pipeline raised
+    compile_stdout: Optional[str] = None
+    compile_stderr: Optional[str] = None
+    compile_returncode: Optional[int] = None
+    compile_log: Optional[str] = None
+    layout_json: Optional[str] = None
+
+    @property
+    def finished_running(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_result(self) -> GenerationResult:
+        compile_result = None
+        if self.compile_returncode is not None:
+            compile_result = CompileResult(self.pdf_bytes, self.compile_stdout or "", self.compile_stderr or "",
+                                           self.compile_returncode, self.compile_log or "")
+        return GenerationResult(
+            tex_code=self.tex_code,
+            pdf_bytes=self.pdf_bytes,
+            change_summary=self.change_summary,
+            summary_missing=self.summary_missing,
+            attempts=self.attempts,
+            error=self.error,
+            compile_result=compile_result,
+            layout=LayoutReport.from_dict(json.loads(self.layout_json)) if self.layout_json else None,
+        )
+
+
+_JOB_COLUMNS = [
+    "id", "status", "created", "started", "finished", "progress", "partial_text", "attempts", "tex_code",
+    "pdf_bytes", "change_summary", "summary_missing", "error", "error_type", "compile_stdout", "compile_stderr",
+    "compile_returncode", "compile_log", "layout_json",
+]
+
+
+class JobQueue:
+    """Jobs in the SQLite database at `db_path`.
+
+    `api_keys` is the in-memory mapping (job id -> key) shared with the
+    workers, e.g. `WorkerPool.api_keys`; jobs with a user key need it.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, api_keys=None):
+        self.db_path = db_path
+        self.api_keys = api_keys
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        if directory == PRIVATE_DB_DIR:
+            if os.stat(directory).st_uid != os.getuid(): # e.g. planted in the shared temp directory
+                raise PermissionError(f"{directory} belongs to another user")
+            os.chmod(directory, 0o700)
+        os.close(os.open(db_path, os.O_CREAT | os.O_RDWR, 0o600))
+        os.chmod(db_path, 0o600)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL") # Readers (UI polling) don't block the writing worker
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "user_key" not in columns: # Databases from before keys were kept out of it
+                conn.execute("ALTER TABLE jobs ADD COLUMN user_key INTEGER NOT NULL DEFAULT 0")
+            if "api_key" in columns:
+                conn.execute("UPDATE jobs SET api_key = NULL WHERE api_key IS NOT NULL")
+
+    def _connect(self):
+        # A connection per call keeps this safe across threads and processes
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    # --- Producer side (UI) ---
+    def submit(self, request: GenerationRequest, api_key=None, stream=False):
+        """Queue a job. `api_key` (a user's own key) is kept in memory only; None leases from the key pool."""
+        if api_key and self.api_keys is None:
+            raise ValueError("JobQueue needs `api_keys` to run jobs with a user's API key")
+        job_id = uuid.uuid4().hex
+        if api_key:
+            self.api_keys[job_id] = api_key
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, created, user_key, stream, tex_input, job_description, summary_requested,"
+                " instructions_pdf, instructions_pdf_name, force_regenerate, candidates, improved_tex_input,"
+                " regenerate_sections, compact_prompt, max_pages, progress)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, time.time(), int(bool(api_key)), int(stream), request.tex_code, request.job_description,
+                 int(request.summary_requested), request.instructions_pdf, request.instructions_pdf_name,
+                 int(request.force_regenerate), request.candidates, request.improved_tex_code,
+                 json.dumps(request.regenerate_sections) if request.regenerate_sections is not None else None,
+                 int(request.compact_prompt), request.max_pages, "Waiting for a free worker..."),
+            )
+        return job_id
+
+    def get(self, job_id) -> Optional[Job]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(**dict(zip(_JOB_COLUMNS, row)))
+        job.summary_missing = bool(job.summary_missing)
+        return job
+
+    def events(self, job_id, after_seq=0):
+        """[(seq, kind, message)] emitted by the pipeline after `after_seq`."""
+        with closing(self._connect()) as conn:
+            return conn.execute(
+                "SELECT seq, kind, message FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after_seq),
+            ).fetchall()
+
+    def position(self, job_id):
+        """Number of queued jobs ahead of `job_id`."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created < (SELECT created FROM jobs WHERE id = ?)",
+                (QUEUED, job_id),
+            ).fetchone()
+        return row[0] if row else 0
+
+    def runs_after(self, after_seq=0):
+        """[(seq, summary)] of runs recorded by workers after `after_seq`."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT seq, summary FROM runs WHERE seq > ? ORDER BY seq", (after_seq,)).fetchall()
+        return [(seq, json.loads(summary)) for seq, summary in rows]
+
+    def last_run_seq(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM runs").fetchone()[0]
+
+    def key_headroom(self, stale_after=STALE_AFTER_SECONDS):
+        """Key pool headroom rows of live workers, each with a "worker" field."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT worker, headroom FROM worker_keys WHERE updated >= ? ORDER BY worker",
+                (time.time() - stale_after,),
+            ).fetchall()
+        return [{"worker": worker, **row} for worker, headroom in rows for row in json.loads(headroom)]
+
+    # --- Consumer side (workers) ---
+    def claim(self, worker_id):
+        """Atomically take the oldest queued job. Returns (job_id, GenerationRequest, api_key, stream) or None.
+
+        Jobs whose user key is no longer in memory (the app restarted) are failed and skipped.
+        """
+        while True:
+            claimed = self._claim_next(worker_id)
+            if claimed is not _KEY_LOST:
+                return claimed
+
+    def _claim_next(self, worker_id):
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, user_key, stream, tex_input, job_description, summary_requested, instructions_pdf,"
+                " instructions_pdf_name, force_regenerate, candidates, improved_tex_input, regenerate_sections,"
+                " compact_prompt, max_pages FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                (QUEUED,),
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            now = time.time()
+            api_key = self.api_keys.get(row[0]) if row[1] and self.api_keys is not None else None
+            if row[1] and not api_key:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, finished = ?, instructions_pdf = NULL, progress = ?, error = ?,"
+                    " error_type = ? WHERE id = ?",
+                    (FAILED, now, "Failed.", "The API key for this job was lost when the app restarted; please run it again.",
+                     "KeyUnavailable", row[0]),
+                )
+                conn.commit()
+                return _KEY_LOST
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started = ?, heartbeat = ?, claims = claims + 1,"
+                " progress = ? WHERE id = ?",
+                (RUNNING, worker_id, now, now, "Starting...", row[0]),
+            )
+            conn.commit()
+        (job_id, _, stream, tex_input, job_description, summary_requested, pdf, pdf_name, force, candidates,
+         improved_tex_input, regenerate_sections, compact_prompt, max_pages) = row
+        request = GenerationRequest(tex_input, job_description, bool(summary_requested), pdf,
+                                    pdf_name or "instructions.pdf", bool(force), candidates, improved_tex_input,
+                                    json.loads(regenerate_sections) if regenerate_sections else None,
+                                    bool(compact_prompt), max_pages)
+        return job_id, request, api_key, bool(stream)
+
+    def heartbeat(self, job_id):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING))
+
+    def add_event(self, job_id, kind, message):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO job_events (job_id, seq, kind, message)"
+                " SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ? FROM job_events WHERE job_id = ?",
+                (job_id, kind, message, job_id),
+            )
+            if kind == "info":
+                conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (message, job_id))
+
+    def record_run(self, summary):
+        """MetricsRecorder sink for worker processes."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT INTO runs (recorded, summary) VALUES (?, ?)",
+                         (time.time(), json.dumps(summary, default=str)))
+
+    def set_key_headroom(self, worker_id, rows):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO worker_keys (worker, updated, headroom) VALUES (?, ?, ?)",
+                         (worker_id, time.time(), json.dumps(rows)))
+
+    def set_partial_text(self, job_id, text):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET partial_text = ? WHERE id = ?", (text, job_id))
+
+    def _forget_key(self, job_id):
+        if self.api_keys is not None:
+            self.api_keys.pop(job_id, None)
+
+    def complete(self, job_id, result: GenerationResult):
+        self._forget_key(job_id)
+        compiled = result.compile_result
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, instructions_pdf = NULL, progress = ?,"
+                " attempts = ?, tex_code = ?, pdf_bytes = ?, change_summary = ?, summary_missing = ?, error = ?,"
+                " compile_stdout = ?, compile_stderr = ?, compile_returncode = ?, compile_log = ?, layout_json = ?"
+                " WHERE id = ?",
+                (SUCCEEDED if result.succeeded else FAILED, time.time(), "Done.", result.attempts, result.tex_code,
+                 result.pdf_bytes, result.change_summary, int(result.summary_missing), result.error,
+                 compiled.stdout if compiled else None, compiled.stderr if compiled else None,
+                 compiled.returncode if compiled else None, compiled.log if compiled else None,
+                 json.dumps(result.layout.to_dict()) if result.layout else None, job_id),
+            )
+
+    def fail(self, job_id, error, error_type=None):
+        self._forget_key(job_id)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, instructions_pdf = NULL, progress = ?,"
+                " error = ?, error_type = ? WHERE id = ?",
+                (FAILED, time.time(), "Failed.", error, error_type, job_id),
+            )
+
+    def requeue_stale(self, stale_after=STALE_AFTER_SECONDS):
+        """Requeue running jobs whose worker died; fail those that already used up MAX_CLAIMS. Returns the count."""
+        cutoff = time.time() - stale_after
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, instructions_pdf = NULL, progress = ?,"
+                " error = ? WHERE status = ? AND heartbeat < ? AND claims >= ?",
+                (FAILED, time.time(), "Failed.", "The worker running this job stopped responding.", RUNNING, cutoff,
+                 MAX_CLAIMS),
+            )
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, progress = ? WHERE status = ? AND heartbeat < ?",
+                (QUEUED, "Requeued after a worker stopped responding...", RUNNING, cutoff),
+            )
+            return cursor.rowcount
+
+    def purge(self, retention=RETENTION_SECONDS):
+        """Delete finished jobs (and their events) older than `retention` seconds, and keys of finished jobs."""
+        cutoff = time.time() - retention
+        with closing(self._connect()) as conn, conn:
+            # Keys of jobs that ended without `complete`/`fail` (e.g. after MAX_CLAIMS)
+            for job_id in list(self.api_keys.keys()) if self.api_keys is not None else []:
+                row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if row is not None and row[0] in FINISHED_STATUSES:
+                    self.api_keys.pop(job_id, None)
+            conn.execute(
+                "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE status IN (?, ?) AND finished < ?)",
+                (*FINISHED_STATUSES, cutoff),
+            )
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?", (*FINISHED_STATUSES, cutoff))
+            conn.execute("DELETE FROM runs WHERE recorded < ?", (cutoff,))
+            conn.execute("DELETE FROM worker_keys WHERE updated < ?", (cutoff,))
+
+
+# --- Worker processes ---
+def _build_pipeline():
+    # Each worker process has its own pipeline; the compile and generation caches are shared on disk.
+    # One job at a time per worker, so one pdflatex process (and scratch directory) is enough
+    janitor = Janitor()
+    compile_engine = CompileEngine(cache=CompileCache(), max_workers=1, scratch_pool=ScratchPool(1, janitor=janitor))
+    # Jobs submitted without a key lease one from the pool; each worker gets an equal share of the key rate
+    return ResumePipeline(compile_engine, default_generation_cache(), file_registry=RemoteFileRegistry(),
+                          janitor=janitor, key_pool=ApiKeyPool.from_env(share=DEFAULT_WORKERS))
+
+
+def run_job(queue, pipeline, job_id, request, api_key, stream):
+    """Execute one claimed job, recording events, streamed text and the outcome in `queue`."""
+    done = threading.Event()
+
+    def keep_alive():
+        while not done.wait(HEARTBEAT_SECONDS):
+            queue.heartbeat(job_id)
+
+    last_partial = [0.0]
+
+    def on_text(text_so_far):
+        now = time.monotonic()
+        if now - last_partial[0] >= PARTIAL_TEXT_INTERVAL_SECONDS:
+            last_partial[0] = now
+            queue.set_partial_text(job_id, text_so_far)
+
+    heartbeat_thread = threading.Thread(target=keep_alive, name=f"heartbeat-{job_id[:8]}", daemon=True)
+    heartbeat_thread.start()
+    try:
+        result = pipeline.run(request, api_key=api_key, stream=stream, on_text=on_text,
+                              on_event=lambda kind, message: queue.add_event(job_id, kind, message))
+    except Exception as e:
+        queue.fail(job_id, f"{type(e).__name__}: {e}", type(e).__name__)
+    else:
+        queue.complete(job_id, result)
+    finally:
+        done.set()
+
+
+def worker_main(db_path, worker_id, stop_event=None, api_keys=None):
+    """Worker process loop: claim, run, repeat. Also requeues stale jobs and purges old ones."""
+    queue = JobQueue(db_path, api_keys)
+    pipeline = _build_pipeline()
+    pipeline.metrics.add_sink(queue.record_run) # Runs reach the app's metrics panel and /metrics
+    last_purge = last_headroom = 0.0
+    while stop_event is None or not stop_event.is_set():
+        queue.requeue_stale()
+        if time.time() - last_purge > PURGE_INTERVAL_SECONDS:
+            queue.purge()
+            last_purge = time.time()
+        if pipeline.key_pool is not None and time.time() - last_headroom > HEARTBEAT_SECONDS:
+            queue.set_key_headroom(worker_id, pipeline.key_pool.headroom())
+            last_headroom = time.time()
+
+        claimed = queue.claim(worker_id)
+        if claimed is None:
+            time.sleep(POLL_INTERVAL_SECONDS)
+            continue
+        run_job(queue, pipeline, *claimed)
+
+
+def follow_runs(queue, recorder, interval=RUN_POLL_SECONDS):
+    """Fold runs recorded by workers from now on into `recorder`, from a daemon thread.
+
+    The workers already logged these runs, so they are only aggregated here.
+    """
+    def follow():
+        last_seq = queue.last_run_seq()
+        while True:
+            time.sleep(interval)
+            try:
+                for last_seq, summary in queue.runs_after(last_seq):
+                    recorder.record(summary, log=False)
+            except sqlite3.Error:
+                pass # Retried on the next poll
+
+    thread = threading.Thread(target=follow, name="worker-runs", daemon=True)
+    thread.start()
+    return thread
+
+
+class WorkerPool:
+    """`workers` worker processes draining the queue at `db_path`.
+
+    `api_keys` (available after `start`) is the in-memory job id -> user key
+    mapping the workers read; give it to the app's JobQueue.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, workers=DEFAULT_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        # Spawn rather than fork: the parent (Streamlit) runs many threads
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        self._processes = []
+        self._manager = None
+        self.api_keys = None
+
+    def start(self):
+        self._manager = self._context.Manager()
+        self.api_keys = self._manager.dict()
+        for index in range(self.workers):
+            worker_id = f"{os.getpid()}-{index}"
+            process = self._context.Process(target=worker_main, args=(self.db_path, worker_id, self._stop, self.api_keys),
+                                            name=f"resume-worker-{index}", daemon=True)
+            process.start()
+            self._processes.append(process)
+        return self
+
+    def alive(self):
+        return sum(1 for process in self._processes if process.is_alive())
+
+    def shutdown(self, timeout=10):
+        self._stop.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
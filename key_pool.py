@@ -0,0 +1,281 @@
+"""A pool of Gemini API keys with per-key rate limiting.
+
+Each key (typically one per project, since quota is per project) has a
+token bucket refilled at `requests_per_minute`; one token is spent per
+`generate_content` call, so speculative candidates, targeted repairs and
+retries are all charged. Runs are routed to the least-loaded key with a
+token available. A key that gets a 429 cools down with jittered exponential
+backoff, and a key that is rejected outright is disabled. When every key
+is exhausted, `lease` (and a call on a drained key) waits for the next
+token up to `max_wait` seconds and then raises ResourceExhausted like a
+single key would.
+
+`genai.configure` sets one client for the whole process, so every Gemini
+call goes through `using_key`: calls on the configured key run
+concurrently, and a call on another key waits until they are done. Within
+one process, runs on different keys therefore take turns; background
+workers are separate processes and run in parallel.
+
+Keys come from `RESUME_API_KEYS` (comma separated), falling back to
+`GOOGLE_API_KEY`. State is per process; worker processes each take an
+equal share of the rate.
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+# --- Configuration ---
+API_KEYS = [key.strip() for key in os.getenv("RESUME_API_KEYS", os.getenv("GOOGLE_API_KEY", "")).split(",") if key.strip()]
+REQUESTS_PER_MINUTE = float(os.getenv("RESUME_KEY_RPM", 10)) # Gemini calls per key per minute
+BURST = int(os.getenv("RESUME_KEY_BURST", 3))
+MAX_WAIT_SECONDS = float(os.getenv("RESUME_KEY_MAX_WAIT", 60))
+COOLDOWN_BASE_SECONDS = 5.0 # Doubled on each consecutive 429 of a key
+COOLDOWN_MAX_SECONDS = 300.0
+
+
+_client_state = threading.Condition()
+_client_key = None # Key `genai` is configured with
+_client_users = 0 # Calls in flight on `_client_key`
+_client_next = None # Key a waiting call switches to next; holds off new calls on the current key
+
+
+@contextmanager
+def using_key(api_key):
+    """Run the enclosed Gemini calls on `api_key`; None uses whatever is configured.
+
+    Not reentrant: a holder must not enter again while holding the key.
+    """
+    global _client_key, _client_users, _client_next
+    if not api_key:
+        yield
+        return
+    with _client_state:
+        while not ((_client_key == api_key or not _client_users) and _client_next in (None, api_key)):
+            if _client_next is None:
+                _client_next = api_key
+            _client_state.wait()
+        if _client_next == api_key:
+            _client_next = None
+            _client_state.notify_all() # Calls on this key may now join; others may claim next
+        if _client_key != api_key:
+            genai.configure(api_key=api_key)
+            _client_key = api_key
+        _client_users += 1
+    try:
+        yield
+    finally:
+        with _client_state:
+            _client_users -= 1
+            _client_state.notify_all()
+
+
+class KeyedModel:
+    """A GenerativeModel whose `generate_content` calls run on `api_key` and are charged to `lease`."""
+
+    def __init__(self, model, api_key, lease=None):
+        self.model = model
+        self.api_key = api_key
+        self.lease = lease
+
+    def generate_content(self, *args, **kwargs):
+        if self.lease is not None:
+            self.lease.charge()
+        # A stream is opened on the client bound here, so it may be consumed after the key is released
+        with using_key(self.api_key):
+            return self.model.generate_content(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def seconds_until_token(self):
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class _KeyState:
+    def __init__(self, label, api_key, bucket):
+        self.label = label # Shown in metrics instead of the key itself
+        self.api_key = api_key
+        self.bucket = bucket
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_429 = 0
+        self.disabled = False
+        self.runs = 0
+        self.calls = 0
+        self.rate_limited = 0
+
+
+class KeyLease:
+    """One run's claim on a key. Each Gemini call `charge`s a token; report how the key did with `rate_limited`/`invalid`."""
+
+    def __init__(self, pool, state):
+        self.api_key = state.api_key
+        self.label = state.label
+        self.tokens_left = state.bucket.tokens # Headroom on this key when the lease was taken
+        self.outcome = "ok"
+        self._pool = pool
+        self._state = state
+
+    def charge(self):
+        self._pool._charge(self._state)
+
+    def rate_limited(self):
+        self.outcome = "rate_limited"
+
+    def invalid(self):
+        self.outcome = "invalid"
+
+
+class ApiKeyPool:
+    def __init__(self, api_keys, requests_per_minute=REQUESTS_PER_MINUTE, burst=BURST, max_wait=MAX_WAIT_SECONDS):
+        if not api_keys:
+            raise ValueError("ApiKeyPool needs at least one API key")
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._keys = [
+            _KeyState(f"key-{index + 1}", api_key, TokenBucket(requests_per_minute / 60.0, max(burst, 1)))
+            for index, api_key in enumerate(dict.fromkeys(api_keys)) # Dedupe, keep order
+        ]
+
+    @classmethod
+    def from_env(cls, share=1):
+        """Pool of the configured keys, or None when none are set. `share` processes split the rate."""
+        if not API_KEYS:
+            return None
+        return cls(API_KEYS, REQUESTS_PER_MINUTE / max(share, 1), max(BURST // max(share, 1), 1))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _pick(self, now):
+        """(state, 0) for the least-loaded usable key with a token, else (None, seconds to wait)."""
+        best, wait_for = None, float("inf")
+        # Random order breaks ties, so separate processes do not all start on the first key
+        for state in random.sample(self._keys, len(self._keys)):
+            if state.disabled:
+                continue
+            state.bucket.refill(now)
+            wait = max(state.cooldown_until - now, state.bucket.seconds_until_token())
+            if wait > 0:
+                wait_for = min(wait_for, wait)
+                continue
+            # Fewest runs in flight, then the most tokens left
+            if best is None or (state.in_flight, -state.bucket.tokens) < (best.in_flight, -best.bucket.tokens):
+                best = state
+        return best, (0.0 if best else wait_for)
+
+    @contextmanager
+    def lease(self, max_wait=None):
+        """Claim a key for one run; waits for a token if every key is busy."""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        deadline = time.monotonic() + max_wait
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                state, wait = self._pick(now)
+                if state is not None:
+                    break
+                if wait == float("inf"):
+                    raise google_exceptions.PermissionDenied("All pooled API keys were rejected.")
+                if now + wait > deadline:
+                    raise google_exceptions.ResourceExhausted("All pooled API keys are rate limited; try again shortly.")
+                self._changed.wait(wait)
+            state.in_flight += 1
+            state.runs += 1
+
+        lease = KeyLease(self, state)
+        try:
+            yield lease
+        finally:
+            self._release(state, lease.outcome)
+
+    def _charge(self, state):
+        """Spend one of the leased key's tokens, waiting up to `max_wait` for it to refill."""
+        deadline = time.monotonic() + self.max_wait
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                state.bucket.refill(now)
+                wait = state.bucket.seconds_until_token()
+                if wait == 0:
+                    break
+                if now + wait > deadline:
+                    raise google_exceptions.ResourceExhausted(f"{state.label} is out of quota; try again shortly.")
+                self._changed.wait(wait)
+            state.bucket.tokens -= 1
+            state.calls += 1
+
+    def _release(self, state, outcome):
+        with self._changed:
+            state.in_flight -= 1
+            if outcome == "rate_limited":
+                state.rate_limited += 1
+                state.consecutive_429 += 1
+                delay = min(COOLDOWN_BASE_SECONDS * 2 ** (state.consecutive_429 - 1), COOLDOWN_MAX_SECONDS)
+                state.cooldown_until = time.monotonic() + delay * random.uniform(0.5, 1.5)
+            elif outcome == "invalid":
+                state.disabled = True
+            else:
+                state.consecutive_429 = 0
+            self._changed.notify_all()
+
+    def headroom(self):
+        """Per-key quota headroom, without the keys themselves."""
+        with self._lock:
+            now = time.monotonic()
+            rows = []
+            for state in self._keys:
+                state.bucket.refill(now)
+                rows.append({
+                    "key": state.label,
+                    "tokens": round(state.bucket.tokens, 2),
+                    "capacity": state.bucket.capacity,
+                    "in_flight": state.in_flight,
+                    "cooldown_s": round(max(state.cooldown_until - now, 0.0), 1),
+                    "runs": state.runs,
+                    "calls": state.calls,
+                    "rate_limited": state.rate_limited,
+                    "disabled": state.disabled,
+                })
+            return rows
+
+    def prometheus_lines(self):
+        return headroom_prometheus_lines(self.headroom())
+
+
+def headroom_prometheus_lines(rows):
+    """Prometheus lines for `headroom()` rows; rows with a "worker" field (from worker processes) are labelled by it."""
+
+    def labels(row):
+        return ",".join(f'{name}="{row[name]}"' for name in ("worker", "key") if name in row)
+
+    lines = []
+    for name, field, kind in (("key_tokens", "tokens", "gauge"), ("key_in_flight", "in_flight", "gauge"),
+                              ("key_cooldown_seconds", "cooldown_s", "gauge"), ("key_runs_total", "runs", "counter"),
+                              ("key_calls_total", "calls", "counter"),
+                              ("key_rate_limited_total", "rate_limited", "counter")):
+        lines.append(f"# TYPE resume_{name} {kind}")
+        lines.extend(f'resume_{name}{{{labels(row)}}} {row[field]:g}' for row in rows)
+    lines.append("# TYPE resume_key_disabled gauge")
+    lines.extend(f'resume_key_disabled{{{labels(row)}}} {int(row["disabled"])}' for row in rows)
+    return lines
@@ -0,0 +1,252 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from compile_cache import cache_key, get_toolchain_version
+
+# --- Configuration ---
+DEFAULT_FORMAT_DIR = os.getenv(
+    "RESUME_FORMAT_DIR",
+    os.path.join(tempfile.gettempdir(), "resume_improv_formats"),
+)
+DEFAULT_MAX_WORKERS = int(os.getenv("RESUME_COMPILE_WORKERS", 2))
+
+BEGIN_DOCUMENT = "\\begin{document}"
+
+
+@dataclass
+class CompileResult:
+    pdf_bytes: Optional[bytes]
+    stdout: str
+    stderr: str
+    returncode: int
+    log: str = ""
+    cached: bool = False
+
+    @property
+    def succeeded(self):
+        # Same success criterion the app has always used: a PDF was produced
+        return self.pdf_bytes is not None
+
+    def error_report(self):
+        """The compile output in the form fed back to Gemini on a retry."""
+        error_msg = "LaTeX Compilation Errors:\n"
+        if self.stdout:
+            error_msg += f"Output:\n{self.stdout}\n"
+        if self.stderr:
+            error_msg += f"Errors:\n{self.stderr}\n"
+        if self.returncode != 0:
+            error_msg += f"Return code: {self.returncode}"
+        return error_msg
+
+
+def split_preamble(tex_code):
+    """Split a document at `\\begin{document}`. Returns (preamble, body) or (None, tex_code)."""
+    index = tex_code.find(BEGIN_DOCUMENT)
+    if index == -1:
+        return None, tex_code
+    return tex_code[:index], tex_code[index:]
+
+
+def _run_pdflatex(tex_code, format_name=None, format_dir=None, scratch_pool=None):
+    """Compile `tex_code` in a scratch directory and collect the outputs.
+
+    With `format_name`, pdflatex starts from that precompiled format instead
+    of plain LaTeX; `format_dir` is added to the format search path. The
+    directory comes from `scratch_pool` (a janitor.ScratchPool) if given,
+    otherwise it is a throwaway temp dir.
+    """
+    if scratch_pool is not None:
+        with scratch_pool.directory() as scratch_dir:
+            return _run_pdflatex_in(scratch_dir, tex_code, format_name, format_dir)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        return _run_pdflatex_in(temp_dir, tex_code, format_name, format_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _run_pdflatex_in(temp_dir, tex_code, format_name=None, format_dir=None):
+    tex_file_path = os.path.join(temp_dir, "resume.tex")
+    pdf_file_path = os.path.join(temp_dir, "resume.pdf")
+    log_file_path = os.path.join(temp_dir, "resume.log")
+
+    # --- Write the LaTeX code to a file ---
+    with open(tex_file_path, "w") as f:
+        f.write(tex_code)
+
+    # --- Compile LaTeX to PDF ---
+    # Run inside the directory with a relative path, so no temp path ends up in the output: the
+    # output is fed back to Gemini on a retry and must be identical for identical documents
+    command = ["pdflatex", "-interaction=nonstopmode"]
+    env = None
+    if format_name:
+        command.append(f"-fmt={format_name}")
+        env = dict(os.environ)
+        # Trailing separator keeps the default TeX Live format path after ours
+        env["TEXFORMATS"] = os.path.abspath(format_dir) + os.pathsep
+    command.append(os.path.basename(tex_file_path))
+    result = subprocess.run(
+        command,
+        cwd=temp_dir,
+        capture_output=True,
+        text=True,
+        check=False,  # Don't raise exception on LaTeX errors
+        env=env,
+    )
+
+    pdf_bytes = None
+    if os.path.exists(pdf_file_path):
+        with open(pdf_file_path, "rb") as pdf_file:
+            pdf_bytes = pdf_file.read()
+
+    log = ""
+    if os.path.exists(log_file_path):
+        with open(log_file_path, "r", errors="replace") as log_file:
+            log = log_file.read()
+
+    return CompileResult(pdf_bytes, result.stdout, result.stderr, result.returncode, log)
+
+
+class FormatCache:
+    """Precompiled pdflatex formats (.fmt), one per distinct preamble.
+
+    Formats are dumped with the `mylatexformat` package (texlive-latex-extra).
+    A document compiled against such a format skips its own preamble up to
+    `\\begin{document}`, so package loading is paid once per preamble rather
+    than once per compile. Preambles that cannot be dumped are remembered and
+    compiled cold from then on.
+    """
+
+    def __init__(self, format_dir=DEFAULT_FORMAT_DIR):
+        self.format_dir = format_dir
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._failed = set()
+        os.makedirs(self.format_dir, exist_ok=True)
+
+    def _format_name(self, preamble):
+        digest = hashlib.sha256()
+        digest.update(get_toolchain_version().encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(preamble.encode("utf-8"))
+        return "preamble-" + digest.hexdigest()[:32]
+
+    def format_for(self, preamble):
+        """Return the format name for `preamble`, dumping it on first use. None if unavailable."""
+        name = self._format_name(preamble)
+        with self._lock:
+            if name in self._failed:
+                return None
+            key_lock = self._key_locks.setdefault(name, threading.Lock())
+
+        # Concurrent compiles of the same preamble wait for a single dump
+        with key_lock:
+            if os.path.exists(os.path.join(self.format_dir, name + ".fmt")):
+                return name
+            if self._dump(name, preamble):
+                return name
+            with self._lock:
+                self._failed.add(name)
+            return None
+
+    def _dump(self, name, preamble):
+        work_dir = tempfile.mkdtemp()
+        try:
+            source_path = os.path.join(work_dir, name + ".tex")
+            with open(source_path, "w") as f:
+                f.write(preamble)
+                f.write("\n\\begin{document}\n\\end{document}\n")
+            try:
+                subprocess.run(
+                    ["pdflatex", "-ini", "-interaction=nonstopmode", f"-jobname={name}",
+                     "&pdflatex", "mylatexformat.ltx", os.path.basename(source_path)],
+                    cwd=work_dir,
+                    capture_output=True,
+                    text=True,
+                    check=False,
+                )
+            except OSError:
+                return False
+            fmt_path = os.path.join(work_dir, name + ".fmt")
+            if not os.path.exists(fmt_path):
+                return False
+            # Rename into place so readers never see a partial format
+            os.replace(fmt_path, os.path.join(self.format_dir, name + ".fmt"))
+            return True
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _compile_with_format(tex_code, format_cache, scratch_pool=None):
+    preamble, _ = split_preamble(tex_code)
+    if preamble is None or format_cache is None:
+        return _run_pdflatex(tex_code, scratch_pool=scratch_pool)
+
+    format_name = format_cache.format_for(preamble)
+    if format_name is None:
+        return _run_pdflatex(tex_code, scratch_pool=scratch_pool)
+
+    result = _run_pdflatex(tex_code, format_name, format_cache.format_dir, scratch_pool)
+    if result.succeeded:
+        return result
+    # Rerun cold so the error log reflects the document itself, not the format
+    return _run_pdflatex(tex_code, scratch_pool=scratch_pool)
+
+
+def compile_latex(tex_code, cache=None, format_cache=None, scratch_pool=None):
+    """Compile LaTeX source to PDF, consulting `cache` (a CompileCache) first if given."""
+    key = None
+    if cache is not None:
+        key = cache_key(tex_code)
+        entry = cache.get(key)
+        if entry is not None:
+            return CompileResult(
+                entry["pdf_bytes"],
+                entry["stdout"],
+                entry["stderr"],
+                entry["returncode"],
+                entry["log"],
+                cached=True,
+            )
+
+    result = _compile_with_format(tex_code, format_cache, scratch_pool)
+
+    if cache is not None:
+        try:
+            cache.put(key, result.pdf_bytes, result.stdout, result.stderr, result.returncode, result.log)
+        except OSError:
+            # A full or read-only cache dir must never fail the compile itself
+            pass
+    return result
+
+
+class CompileEngine:
+    """Bounded pool of pdflatex workers sharing a compile cache and preamble formats.
+
+    At most `max_workers` pdflatex processes run at once per server process;
+    further compiles queue. `submit` returns a Future so callers can overlap
+    compilation with other work. With a `scratch_pool` (janitor.ScratchPool),
+    pdflatex runs in reused directories instead of fresh temp dirs.
+    """
+
+    def __init__(self, cache=None, format_cache=None, max_workers=DEFAULT_MAX_WORKERS, scratch_pool=None):
+        self.cache = cache
+        self.format_cache = format_cache if format_cache is not None else FormatCache()
+        self.scratch_pool = scratch_pool
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pdflatex")
+
+    def submit(self, tex_code):
+        return self._executor.submit(compile_latex, tex_code, self.cache, self.format_cache, self.scratch_pool)
+
+    def compile(self, tex_code):
+        return self.submit(tex_code).result()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,197 @@
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from latex_repair import parse_latex_log
+
+# --- Configuration ---
+MAX_FIX_PASSES = 3
+
+_FENCE_LINE = re.compile(r"^\s*```[a-zA-Z]*\s*$")
+_MARKDOWN_BOLD = re.compile(r"\*\*([^*\n]+?)\*\*")
+# Spans whose special characters must be left alone: inline math, URLs
+_PROTECTED_SPAN = re.compile(r"\$[^$]*\$|\\(?:url|href)\{[^}]*\}")
+_ENV_MISMATCH = re.compile(r"\\begin\{([^}]+)\} on input line \d+ ended by \\end\{([^}]+)\}")
+
+# pdflatex message -> special character to escape on the offending line
+_ESCAPE_RULES = (
+    ("Misplaced alignment tab character &", "&"),
+    ("Missing $ inserted", "_"),
+    ("You can't use `macro parameter character #'", "#"),
+)
+_UNCLOSED_BRACE_MESSAGES = ("Paragraph ended before", "File ended while scanning", "Runaway argument")
+
+
+@dataclass
+class FixOutcome:
+    tex_code: str
+    result: object # CompileResult of the fixed document
+    applied: List[str] = field(default_factory=list)
+
+
+def _split_comment(line):
+    """Split a line into (code, comment) at the first unescaped %."""
+    index = 0
+    while index < len(line):
+        char = line[index]
+        if char == "\\":
+            index += 2
+            continue
+        if char == "%":
+            return line[:index], line[index:]
+        index += 1
+    return line, ""
+
+
+def _escape_char(code, char):
+    """Escape unescaped `char` in `code`, leaving math and URLs untouched."""
+    pieces = []
+    last = 0
+    for span in _PROTECTED_SPAN.finditer(code):
+        pieces.append((code[last:span.start()], True))
+        pieces.append((span.group(0), False))
+        last = span.end()
+    pieces.append((code[last:], True))
+    unescaped = re.compile(r"(?<!\\)" + re.escape(char))
+    return "".join(unescaped.sub("\\\\" + char, text) if editable else text for text, editable in pieces)
+
+
+def _escape_percentages(line):
+    # "30% faster": an unescaped % right after a digit is a percentage, not a comment.
+    # Math and URLs are skipped as in `_escape_char`, so "%20" in an \href stays percent-encoding
+    index = 0
+    while index < len(line):
+        span = _PROTECTED_SPAN.match(line, index)
+        if span:
+            index = span.end()
+            continue
+        char = line[index]
+        if char == "\\":
+            index += 2
+            continue
+        if char == "%":
+            if not (index and line[index - 1].isdigit()):
+                break # A real comment starts here
+            line = line[:index] + "\\" + line[index:]
+            index += 2
+            continue
+        index += 1
+    return line
+
+
+def _brace_balance(code):
+    balance = 0
+    index = 0
+    while index < len(code):
+        char = code[index]
+        if char == "\\":
+            index += 2
+            continue
+        if char == "{":
+            balance += 1
+        elif char == "}":
+            balance -= 1
+        index += 1
+    return balance
+
+
+def sanitize_latex(tex_code):
+    """Pre-compile cleanup of common LLM output artifacts. Returns (tex_code, applied_rules)."""
+    applied = []
+
+    # Chatter before the document class ("Here is the improved resume:")
+    start = tex_code.find("\\documentclass")
+    if start > 0 and tex_code[:start].strip():
+        tex_code = tex_code[start:]
+        applied.append("dropped text before \\documentclass")
+
+    lines = tex_code.split("\n")
+    kept = [line for line in lines if not _FENCE_LINE.match(line)]
+    if len(kept) != len(lines):
+        applied.append("removed markdown fences")
+
+    cleaned = []
+    for line in kept:
+        escaped = _escape_percentages(line)
+        if escaped != line:
+            applied.append("escaped percent signs")
+        code, comment = _split_comment(escaped)
+        new_code = _MARKDOWN_BOLD.sub(r"\\textbf{\1}", code)
+        if new_code != code:
+            applied.append("converted markdown bold")
+        cleaned.append(new_code + comment)
+
+    return "\n".join(cleaned), sorted(set(applied), key=applied.index)
+
+
+def fix_from_errors(tex_code, errors):
+    """Apply rule-based fixes for the given parsed pdflatex errors. Returns (tex_code, applied_rules)."""
+    lines = tex_code.split("\n")
+    applied = []
+    insertions = [] # (line_index, text) added after the per-line edits
+
+    for error in errors:
+        if not error.line or error.line > len(lines):
+            continue
+        index = error.line - 1
+
+        for message, char in _ESCAPE_RULES:
+            if error.message.startswith(message):
+                code, comment = _split_comment(lines[index])
+                new_code = _escape_char(code, char)
+                if new_code != code:
+                    lines[index] = new_code + comment
+                    applied.append(f"escaped {char} on line {error.line}")
+                break
+
+        mismatch = _ENV_MISMATCH.search(error.message)
+        if mismatch:
+            insertions.append((index, f"\\end{{{mismatch.group(1)}}}"))
+            applied.append(f"closed {mismatch.group(1)} before line {error.line}")
+
+        if error.message.startswith("Too many }'s"):
+            code, comment = _split_comment(lines[index])
+            position = code.rfind("}")
+            if position != -1:
+                lines[index] = code[:position] + code[position + 1:] + comment
+                applied.append(f"removed extra }} on line {error.line}")
+
+        if error.message.startswith(_UNCLOSED_BRACE_MESSAGES):
+            # Close the nearest preceding line that opens more braces than it closes
+            for candidate in range(index, max(-1, index - 15), -1):
+                code, comment = _split_comment(lines[candidate])
+                balance = _brace_balance(code)
+                if balance > 0:
+                    lines[candidate] = code + "}" * balance + comment
+                    applied.append(f"closed {balance} brace(s) on line {candidate + 1}")
+                    break
+
+    # Insert bottom-up so earlier indexes stay valid
+    for index, text in sorted(set(insertions), reverse=True):
+        lines.insert(index, text)
+
+    return "\n".join(lines), applied
+
+
+def autofix_and_compile(tex_code, log, compile_fn, max_passes=MAX_FIX_PASSES):
+    """Fix mechanical errors locally and recompile, up to `max_passes` times.
+
+    Returns a FixOutcome with the best version reached, or None if no rule
+    applied. A pass that increases the number of errors is discarded.
+    """
+    errors = parse_latex_log(log)
+    outcome = None
+    for _ in range(max_passes):
+        fixed, applied = fix_from_errors(tex_code, errors)
+        if not applied:
+            break
+        result = compile_fn(fixed)
+        new_errors = parse_latex_log(result.log)
+        if not result.succeeded and len(new_errors) > len(errors):
+            break
+        applied = (outcome.applied if outcome else []) + applied
+        outcome = FixOutcome(fixed, result, applied)
+        if result.succeeded:
+            break
+        tex_code, errors = fixed, new_errors
+    return outcome
@@ -0,0 +1,150 @@
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+# --- Configuration ---
+WINDOW_RADIUS = 4 # Lines of context sent on each side of an error
+MAX_ERRORS = 5
+
+_ERROR_LINE = re.compile(r"^! (.*)$")
+_LOCATION_LINE = re.compile(r"^l\.(\d+) ?(.*)$")
+_PATCH_BLOCK = re.compile(r"^### LINES (\d+)-(\d+)[ \t]*\n```(?:latex)?[ \t]*\n(.*?)\n?```", re.MULTILINE | re.DOTALL)
+
+
+@dataclass
+class LatexError:
+    message: str
+    error_class: str
+    line: Optional[int] = None
+    snippet: str = ""
+
+
+@dataclass
+class RepairOutcome:
+    tex_code: str
+    result: object # CompileResult of the patched document
+    errors: List[LatexError]
+
+
+def _error_class(message):
+    # "LaTeX Error: Environment itemiz undefined." -> "LaTeX Error"
+    # "Undefined control sequence." -> "Undefined control sequence"
+    if ":" in message:
+        return message.split(":", 1)[0].strip()
+    return message.rstrip(".").strip()
+
+
+def parse_latex_log(log):
+    """Extract structured errors from a pdflatex log.
+
+    Each `! message` line starts an error; the `l.<n> <text>` line that
+    follows (if any) gives its line number and the offending source.
+    """
+    errors = []
+    lines = log.splitlines()
+    index = 0
+    while index < len(lines):
+        match = _ERROR_LINE.match(lines[index])
+        if not match:
+            index += 1
+            continue
+        message = match.group(1).strip()
+        error = LatexError(message=message, error_class=_error_class(message))
+        # The location line follows within a few lines of help text
+        for lookahead in range(index + 1, min(index + 20, len(lines))):
+            if _ERROR_LINE.match(lines[lookahead]):
+                break
+            location = _LOCATION_LINE.match(lines[lookahead])
+            if location:
+                error.line = int(location.group(1))
+                error.snippet = location.group(2).strip()
+                index = lookahead
+                break
+        errors.append(error)
+        index += 1
+    return errors
+
+
+def error_windows(tex_code, errors, radius=WINDOW_RADIUS):
+    """Merge the line windows around each located error into sorted, non-overlapping (start, end) ranges."""
+    line_count = len(tex_code.split("\n"))
+    ranges = sorted(
+        (max(1, error.line - radius), min(line_count, error.line + radius))
+        for error in errors
+        if error.line and error.line <= line_count
+    )
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def build_repair_prompt(tex_code, errors, windows):
+    lines = tex_code.split("\n")
+    prompt_parts = [
+        "You are an expert LaTeX editor. A resume failed to compile with pdflatex.",
+        "Only the excerpts around each error are shown. Fix the errors with the smallest possible change and do not alter any other content.",
+        "\n**Errors:**",
+    ]
+    for error in errors:
+        location = f"Line {error.line}" if error.line else "Unknown line"
+        snippet = f" (near `{error.snippet}`)" if error.snippet else ""
+        prompt_parts.append(f"- {location}: {error.message}{snippet}")
+
+    prompt_parts.append("\n**Excerpts:**")
+    for start, end in windows:
+        prompt_parts.append(f"### LINES {start}-{end}\n```latex\n" + "\n".join(lines[start - 1:end]) + "\n```")
+
+    prompt_parts.extend([
+        "\n**Output Requirements:**",
+        "- For every excerpt, output its header line (e.g. `### LINES 10-18`) exactly as given, followed by a ```latex block containing the corrected replacement for those lines.",
+        "- The replacement may have more or fewer lines than the excerpt.",
+        "- Do NOT output anything else: no explanations and no other parts of the document.",
+    ])
+    return prompt_parts
+
+
+def parse_patches(response_text, windows):
+    """Return {(start, end): replacement} for the excerpts Gemini sent back. Unknown ranges are ignored."""
+    allowed = set(windows)
+    patches = {}
+    for match in _PATCH_BLOCK.finditer(response_text or ""):
+        window = (int(match.group(1)), int(match.group(2)))
+        if window in allowed:
+            patches[window] = match.group(3)
+    return patches
+
+
+def apply_patches(tex_code, patches):
+    lines = tex_code.split("\n")
+    # Bottom-up so earlier line numbers stay valid
+    for (start, end), replacement in sorted(patches.items(), reverse=True):
+        lines[start - 1:end] = replacement.split("\n")
+    return "\n".join(lines)
+
+
+def attempt_targeted_repair(tex_code, log, generate_text, compile_fn, max_errors=MAX_ERRORS):
+    """Repair only the failing lines and recompile.
+
+    `generate_text(prompt_parts)` returns the model's response text and
+    `compile_fn(tex_code)` returns a CompileResult. Returns a RepairOutcome,
+    or None when the log has no located errors or the response held no
+    usable patch; the caller then falls back to full regeneration.
+    """
+    errors = [error for error in parse_latex_log(log) if error.line][:max_errors]
+    if not errors:
+        return None
+    windows = error_windows(tex_code, errors)
+    if not windows:
+        return None
+
+    response_text = generate_text(build_repair_prompt(tex_code, errors, windows))
+    patches = parse_patches(response_text, windows)
+    if not patches:
+        return None
+
+    repaired = apply_patches(tex_code, patches)
+    return RepairOutcome(repaired, compile_fn(repaired), errors)
@@ -0,0 +1,134 @@
+"""Post-compile layout checks that never rasterize a page.
+
+Page count, overfull boxes and font warnings come from the pdflatex log;
+how full the last page is and whether text runs off the page come from
+PyMuPDF's text extraction. When a resume spills slightly past its page
+budget, `tighten_to_fit` retries the compile with progressively tighter
+line spacing and a taller first page, which is far cheaper than asking
+Gemini to shorten the content.
+"""
+import re
+from dataclasses import asdict, dataclass, field
+from typing import List
+
+import fitz # PyMuPDF
+
+from sections import BEGIN_DOCUMENT
+
+# --- Configuration ---
+MAX_SPILL_FRACTION = 0.3 # Only tighten when the overflow page is at most this full
+EDGE_TOLERANCE_PT = 1.0
+MAX_FONT_WARNINGS = 10
+TIGHTEN_MARKER = "% resume-improv: tightened to fit the page budget"
+# (line spread, extra lines on the first page), tried in order
+TIGHTEN_STEPS = ((0.97, 1), (0.94, 2), (0.9, 3))
+
+_OUTPUT_WRITTEN = re.compile(r"Output written on .*?\((\d+) pages?")
+_OVERFULL = re.compile(r"Overfull \\[hv]box \((\d+(?:\.\d+)?)pt too (?:wide|high)\)")
+_UNDERFULL = re.compile(r"Underfull \\[hv]box")
+_FONT_WARNING = re.compile(r"^(LaTeX Font Warning: .*|Missing character: .*)$", re.MULTILINE)
+
+
+@dataclass
+class LayoutReport:
+    page_count: int = 0
+    last_page_fill: float = 0.0 # Lowest text on the last page, as a fraction of its height
+    overfull_boxes: int = 0
+    max_overfull_pt: float = 0.0
+    underfull_boxes: int = 0
+    text_off_page: int = 0 # Text blocks extending past the page edges
+    words: int = 0
+    font_warnings: List[str] = field(default_factory=list)
+    tightened: bool = False
+
+    def spills_over(self, max_pages):
+        return max_pages is not None and self.page_count > max_pages
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+def parse_log(log, report):
+    """Fill log-derived fields of `report` from a pdflatex log."""
+    log = log or ""
+    match = _OUTPUT_WRITTEN.search(log)
+    if match:
+        report.page_count = int(match.group(1))
+    overfull = [float(points) for points in _OVERFULL.findall(log)]
+    report.overfull_boxes = len(overfull)
+    report.max_overfull_pt = max(overfull, default=0.0)
+    report.underfull_boxes = len(_UNDERFULL.findall(log))
+    warnings = []
+    for warning in _FONT_WARNING.findall(log):
+        warning = warning.strip()
+        if warning not in warnings:
+            warnings.append(warning)
+    report.font_warnings = warnings[:MAX_FONT_WARNINGS]
+    return report
+
+
+def analyze_layout(pdf_bytes, log=""):
+    """LayoutReport for a compiled resume, from the log and the PDF's text layer only."""
+    report = parse_log(log, LayoutReport())
+    if not pdf_bytes:
+        return report
+    try:
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+            report.page_count = pdf_doc.page_count
+            for page_index in range(pdf_doc.page_count):
+                page = pdf_doc.load_page(page_index)
+                width, height = page.rect.width, page.rect.height
+                blocks = [block for block in page.get_text("blocks") if block[4].strip()]
+                report.words += sum(len(block[4].split()) for block in blocks)
+                report.text_off_page += sum(
+                    1 for x0, y0, x1, y1, *_ in blocks
+                    if x0 < -EDGE_TOLERANCE_PT or y0 < -EDGE_TOLERANCE_PT
+                    or x1 > width + EDGE_TOLERANCE_PT or y1 > height + EDGE_TOLERANCE_PT
+                )
+                if page_index == pdf_doc.page_count - 1 and height:
+                    report.last_page_fill = round(max((block[3] for block in blocks), default=0.0) / height, 3)
+    except Exception:
+        # The log-derived numbers are still useful if the PDF cannot be read
+        pass
+    return report
+
+
+def apply_tightening(tex_code, line_spread, extra_lines):
+    """Tighter line spacing and a taller first page, inserted right after \\begin{document}."""
+    begin = tex_code.find(BEGIN_DOCUMENT)
+    if begin == -1:
+        return None
+    insert_at = begin + len(BEGIN_DOCUMENT)
+    tightening = (f"\n{TIGHTEN_MARKER}\n\\linespread{{{line_spread}}}\\selectfont"
+                  f"\\enlargethispage{{{extra_lines}\\baselineskip}}")
+    return tex_code[:insert_at] + tightening + tex_code[insert_at:]
+
+
+def tighten_to_fit(tex_code, report, compile_fn, max_pages=1):
+    """Recompile with tighter spacing until the resume fits `max_pages`.
+
+    Only attempted when the overflow is small (the last page is at most
+    MAX_SPILL_FRACTION full) and the document has not been tightened yet.
+    Returns (tex_code, CompileResult, LayoutReport) for the first step that
+    fits, or None.
+    """
+    if not report.spills_over(max_pages) or report.page_count > max_pages + 1:
+        return None
+    if report.last_page_fill > MAX_SPILL_FRACTION or TIGHTEN_MARKER in tex_code:
+        return None
+    for line_spread, extra_lines in TIGHTEN_STEPS:
+        candidate = apply_tightening(tex_code, line_spread, extra_lines)
+        if candidate is None:
+            return None
+        result = compile_fn(candidate)
+        if not result.succeeded:
+            return None
+        candidate_report = analyze_layout(result.pdf_bytes, result.log)
+        if not candidate_report.spills_over(max_pages):
+            candidate_report.tightened = True
+            return candidate, result, candidate_report
+    return None
@@ -1,16 +1,22 @@
 import streamlit as st
-import google.generativeai as genai
 import os
 from pathlib import Path
-import time
-import tempfile
-import subprocess
-import shutil
-import base64
-import fitz # PyMuPDF for image preview
 import io   # For handling image bytes
+import time
 # Import Google API exceptions
 from google.api_core import exceptions as google_exceptions
+from batch import DEFAULT_CONCURRENCY, BatchJob, build_zip, iter_batch
+from compile_cache import CompileCache
+from gemini_files import RemoteFileRegistry
+from generation_cache import default_generation_cache
+from janitor import Janitor, ScratchPool
+from key_pool import API_KEYS, ApiKeyPool, headroom_prometheus_lines
+from job_queue import DEFAULT_WORKERS, POLL_INTERVAL_SECONDS, QUEUED, JobQueue, WorkerPool, follow_runs
+from latex_compiler import CompileEngine
+from metrics import METRICS_PORT, MetricsRecorder, serve_metrics
+from pdf_preview import FULL_DPI, THUMBNAIL_DPI, PreviewCache
+from pipeline import MAX_CANDIDATES, GenerationRequest, ResumePipeline
+from sections import PREAMBLE, changed_sections, section_keys
 
 # Initialize session state variables
 if 'improved_tex_code' not in st.session_state:
@@ -28,8 +34,24 @@ if 'show_api_input' not in st.session_state:
     st.session_state.show_api_input = False
 if 'change_summary' not in st.session_state:
     st.session_state.change_summary = None
+if 'layout' not in st.session_state: # LayoutReport of the stored PDF
+    st.session_state.layout = None
 if 'request_summary' not in st.session_state: # Track checkbox state
     st.session_state.request_summary = False
+if 'batch_zip' not in st.session_state:
+    st.session_state.batch_zip = None
+if 'stream_output' not in st.session_state:
+    st.session_state.stream_output = True
+if 'current_job' not in st.session_state: # Background job id; kept in the URL so a refresh can pick it up again
+    st.session_state.current_job = st.query_params.get("job")
+if 'shown_job' not in st.session_state: # Last finished job whose result was already handled
+    st.session_state.shown_job = None
+if 'base_tex_code' not in st.session_state: # Input LaTeX that produced the stored result, for section diffs
+    st.session_state.base_tex_code = None
+if 'submitted_tex_code' not in st.session_state:
+    st.session_state.submitted_tex_code = None
+if 'submitted_job_description' not in st.session_state: # Job description the stored result is matched against
+    st.session_state.submitted_job_description = None
 
 # --- Configuration ---
 st.set_page_config(page_title="Resume Improver with Gemini", layout="wide")
@@ -39,6 +61,249 @@ Paste your **current resume's LaTeX (.tex) code** below. Optionally upload a **P
 Gemini 2.5 Pro will analyze both and generate an improved LaTeX version.
 """)
 
+# --- Shared Resources ---
+@st.cache_resource
+def get_compile_cache():
+    # One on-disk compile cache shared by all sessions in this server process
+    return CompileCache()
+
+@st.cache_resource
+def get_janitor():
+    # Deletes per-run uploads and recycles scratch directories off the request path
+    return Janitor()
+
+@st.cache_resource
+def get_scratch_pool():
+    # Reusable pdflatex working directories, on tmpfs when /dev/shm is available
+    return ScratchPool(janitor=get_janitor())
+
+@st.cache_resource
+def get_compile_engine():
+    # Bounded pdflatex worker pool with per-preamble precompiled formats
+    return CompileEngine(cache=get_compile_cache(), scratch_pool=get_scratch_pool())
+
+@st.cache_resource
+def get_generation_cache():
+    # In-memory LRU in front of an on-disk SQLite store, both with a TTL
+    return default_generation_cache()
+
+@st.cache_resource
+def get_preview_cache():
+    # Rendered preview pages keyed by PDF hash + page + DPI, memory-bounded
+    return PreviewCache()
+
+@st.cache_resource
+def get_file_registry():
+    # Uploaded instruction PDFs, reused across requests until Gemini expires them
+    return RemoteFileRegistry()
+
+@st.cache_resource
+def get_job_queue():
+    # Generations run in worker processes and survive reruns/refreshes; RESUME_JOB_WORKERS=0 runs them in-process
+    if DEFAULT_WORKERS <= 0:
+        return None
+    job_queue = JobQueue()
+    # Users' own API keys go to the workers in memory, never into the database
+    job_queue.api_keys = WorkerPool(job_queue.db_path, DEFAULT_WORKERS).start().api_keys
+    # Workers record their runs and key headroom in the queue DB; show them in the panel and /metrics
+    follow_runs(job_queue, get_metrics())
+    if API_KEYS:
+        get_metrics().add_collector(lambda: headroom_prometheus_lines(job_queue.key_headroom()))
+    return job_queue
+
+@st.cache_resource
+def get_metrics():
+    # Per-stage timings of recent runs; also served as Prometheus text when RESUME_METRICS_PORT is set
+    recorder = MetricsRecorder()
+    if METRICS_PORT:
+        serve_metrics(recorder, METRICS_PORT)
+    return recorder
+
+@st.cache_resource
+def get_key_pool():
+    # Rate-limited pool of the deployment's API keys (RESUME_API_KEYS / GOOGLE_API_KEY); None without env keys
+    key_pool = ApiKeyPool.from_env()
+    if key_pool is not None and get_job_queue() is None: # With workers, their pools are exported instead
+        get_metrics().add_collector(key_pool.prometheus_lines)
+    return key_pool
+
+@st.cache_resource
+def get_pipeline():
+    # Headless generation pipeline; this script is only the UI over it
+    return ResumePipeline(get_compile_engine(), get_generation_cache(), get_preview_cache(), get_file_registry(),
+                          metrics=get_metrics(), janitor=get_janitor(), key_pool=get_key_pool())
+
+def render_pdf_preview(pdf_bytes, key_prefix):
+    # Nothing is rasterized until the user asks for the preview, and then only the selected page
+    if not st.toggle("📄 Preview Generated PDF", value=False, key=f"{key_prefix}_preview_toggle"):
+        return
+    try:
+        pipeline = get_pipeline()
+        page_count = pipeline.page_count(pdf_bytes)
+        if page_count == 0:
+            st.warning("PDF is empty, cannot generate preview.")
+            return
+        page_num = 0
+        if page_count > 1:
+            page_num = st.number_input("Page", min_value=1, max_value=page_count, value=1, key=f"{key_prefix}_preview_page") - 1
+        high_res = st.toggle("High resolution", value=False, key=f"{key_prefix}_preview_hires")
+        dpi = FULL_DPI if high_res else THUMBNAIL_DPI
+        img_bytes = pipeline.preview_page(pdf_bytes, page_num, dpi)
+        st.image(io.BytesIO(img_bytes),
+                 caption=f"Page {page_num + 1} of {page_count}",
+                 use_container_width=True)
+    except Exception as e:
+        st.error(f"Error generating PDF preview: {e}")
+
+def render_layout(layout):
+    # Layout metrics come from the log and text layer; nothing is rendered to an image
+    page_col, fill_col, overfull_col, words_col = st.columns(4)
+    page_col.metric("Pages", layout.page_count, help="Spacing was tightened to fit the page budget." if layout.tightened else None)
+    fill_col.metric("Last page filled", f"{layout.last_page_fill:.0%}")
+    overfull_col.metric("Overfull boxes", layout.overfull_boxes,
+                        help=f"Largest overflow: {layout.max_overfull_pt:.1f}pt" if layout.overfull_boxes else None)
+    words_col.metric("Words", layout.words)
+    if layout.tightened:
+        st.caption("ℹ️ Line spacing was tightened slightly so the resume fits the page budget.")
+    if layout.text_off_page:
+        st.warning(f"⚠️ {layout.text_off_page} block(s) of text run past the page edge.")
+    if layout.font_warnings:
+        with st.expander(f"Font warnings ({len(layout.font_warnings)})", expanded=False):
+            st.code("\n".join(layout.font_warnings), language="text")
+
+def render_exports(exports):
+    # Text, Markdown and thumbnail come from one cached pass over the PDF; only the keyword match is per job description
+    ats = exports.ats
+    thumb_col, ats_col = st.columns([1, 4])
+    if exports.artifacts.thumbnail_png:
+        thumb_col.image(io.BytesIO(exports.artifacts.thumbnail_png), caption="Page 1", use_container_width=True)
+    if ats.keywords:
+        ats_col.metric("ATS keyword match", f"{ats.score:.0%}", help=f"{len(ats.matched)} of {len(ats.keywords)} job description keywords found in the PDF text")
+        if ats.missing:
+            ats_col.caption("Missing: " + ", ".join(ats.missing))
+    else:
+        ats_col.caption("Add a job description to check ATS keyword coverage.")
+    with st.expander("🔎 Text as an ATS reads it", expanded=False):
+        st.text(exports.artifacts.text)
+
+def render_results(tex_code, change_summary, pdf_bytes, key_prefix, layout=None, job_description=""):
+    with st.expander("📝 View Generated LaTeX Code", expanded=False):
+        st.code(tex_code, language='latex')
+    st.success("✅ Improved LaTeX code generated successfully!")
+
+    # Display the summary ONLY if it exists (i.e., was requested and generated)
+    if change_summary:
+        with st.expander("📊 Summary of Changes", expanded=True):
+             st.markdown(change_summary)
+
+    # Display PDF preview and download button if PDF exists
+    if pdf_bytes:
+        st.success("✅ PDF generated successfully!")
+        if layout is not None:
+            render_layout(layout)
+
+        exports = None
+        try:
+            exports = get_pipeline().export(pdf_bytes, job_description)
+        except Exception as e:
+            st.warning(f"⚠️ Could not extract text from the PDF: {e}")
+        if exports is not None:
+            render_exports(exports)
+
+        # --- PDF Preview (rendered on demand) ---
+        render_pdf_preview(pdf_bytes, key_prefix=key_prefix)
+
+        # --- Download Buttons ---
+        pdf_col, text_col, markdown_col = st.columns(3)
+        pdf_col.download_button(
+            label="📥 Download PDF",
+            data=pdf_bytes,
+            file_name="improved_resume.pdf",
+            mime="application/pdf",
+            key=f"{key_prefix}_download"
+        )
+        if exports is not None:
+            text_col.download_button("📥 Download Plain Text", data=exports.artifacts.text, file_name="improved_resume.txt",
+                                     mime="text/plain", key=f"{key_prefix}_download_text")
+            markdown_col.download_button("📥 Download Markdown", data=exports.artifacts.markdown, file_name="improved_resume.md",
+                                         mime="text/markdown", key=f"{key_prefix}_download_markdown")
+
+def request_api_key():
+    # Env keys are routed through the key pool (None lets the pipeline pick); a user's own key is used as is
+    if st.session_state.api_source == 'env' and get_key_pool() is not None:
+        return None
+    return st.session_state.api_key
+
+def handle_api_key_failure(api_error, rate_limited=False):
+    st.error(f"API Error: {api_error}")
+    if rate_limited and st.session_state.api_source == 'env' and get_key_pool() is not None:
+        # Every pooled key was tried and is cooling down; the pool recovers by itself
+        st.warning(f"⚠️ All {len(get_key_pool())} API keys are rate limited right now. Please try again in a minute.")
+        return
+    if st.session_state.api_source == 'env':
+        st.warning("⚠️ The default API key failed (Permission Denied or Rate Limit Exceeded). Please enter your own key below.")
+        st.session_state.show_api_input = True
+        st.session_state.api_key = None # Clear the invalid env key
+        st.session_state.api_source = None # Reset source
+        st.experimental_rerun() # Rerun to show input and stop current execution
+    else: # Error occurred with user-provided key
+        st.error("❌ Your provided API key failed. Please check it and try again.")
+        st.session_state.api_key = None # Clear the invalid user key
+        st.session_state.api_source = None
+        st.session_state.show_api_input = True # Make sure input is shown
+        st.experimental_rerun() # Rerun to ensure UI updates
+
+def show_generation_result(result):
+    st.session_state.retry_count = result.attempts
+    if result.summary_missing:
+        st.warning("⚠️ Summary was requested, but Gemini did not provide a summary separator. Displaying full response as LaTeX.")
+
+    if result.succeeded:
+        # Store results in session state (conditionally includes summary)
+        st.session_state.improved_tex_code = result.tex_code
+        st.session_state.base_tex_code = st.session_state.submitted_tex_code
+        st.session_state.pdf_bytes = result.pdf_bytes
+        st.session_state.change_summary = result.change_summary # Store None if no summary
+        st.session_state.layout = result.layout
+        summary_area.empty() # Clear placeholder if successful
+        st.toast("Generation Complete!", icon="🎉")
+        # Same key prefix as the stored block below: preview widgets keep their state on the rerun they trigger
+        render_results(result.tex_code, result.change_summary, result.pdf_bytes, key_prefix="result", layout=result.layout,
+                       job_description=st.session_state.submitted_job_description or job_description)
+    elif result.compile_result is not None:
+        compile_result = result.compile_result
+        st.error("❌ Maximum retries reached. Please check the LaTeX code for errors.")
+        st.text("LaTeX Compilation Output:")
+        st.code(compile_result.stdout, language="text")
+        st.text("LaTeX Compilation Errors:")
+        st.code(compile_result.stderr, language="text")
+        if compile_result.returncode != 0:
+            st.error(f"❌ LaTeX compilation failed with return code {compile_result.returncode}")
+    else:
+        output_area.error(f"❌ {result.error}")
+
+def wait_for_job(job_queue, job_id):
+    # Polls the job row; the work itself happens in a worker process, so a rerun only interrupts the polling
+    seen_seq = 0
+    with st.spinner("🧠 Gemini is thinking..."):
+        while True:
+            for seq, kind, message in job_queue.events(job_id, seen_seq):
+                seen_seq = seq
+                if kind == "warning":
+                    st.warning(message)
+                elif kind == "toast":
+                    st.toast(message)
+            job = job_queue.get(job_id)
+            if job is None or job.finished_running:
+                return job
+            if job.status == QUEUED:
+                output_area.info(f"⏳ Queued ({job_queue.position(job_id)} ahead of you)...")
+            elif job.partial_text:
+                output_area.code(job.partial_text, language='latex')
+            elif job.progress:
+                output_area.info(job.progress)
+            time.sleep(POLL_INTERVAL_SECONDS)
+
 # --- Load Default Resume Content ---
 default_resume_content = ""
 try:
@@ -49,7 +314,7 @@ except FileNotFoundError:
 
 # --- API Key Handling ---
 # Try environment variable first
-env_api_key = os.getenv("GOOGLE_API_KEY")
+env_api_key = os.getenv("GOOGLE_API_KEY") or next(iter(API_KEYS), None)
 
 # Determine initial API key state only once or if reset
 if st.session_state.api_source is None:
@@ -97,6 +362,31 @@ with col2:
 # --- Options --- (Moved checkbox here)
 st.subheader("Options")
 st.session_state.request_summary = st.checkbox("Include summary of changes?", value=st.session_state.request_summary, key="summary_checkbox")
+st.session_state.stream_output = st.checkbox("Stream output as it is generated", value=st.session_state.stream_output, key="stream_checkbox",
+                                             help="Shows Gemini's response live and starts compiling the PDF as soon as the LaTeX is complete.")
+force_regenerate = st.checkbox("Force regenerate (ignore cached responses)", value=False, key="force_regenerate_checkbox",
+                               help="Identical inputs normally reuse the previous Gemini response. Tick this to ask Gemini again.")
+fit_one_page = st.checkbox("Keep to one page", value=True, key="fit_one_page_checkbox",
+                           help="If the PDF spills slightly onto a second page, line spacing is tightened automatically. A warning is shown if it still does not fit.")
+compact_prompt = st.checkbox("Compact prompt", value=True, key="compact_prompt_checkbox",
+                             help="Strips comments and extra whitespace and sends a placeholder instead of the preamble, which is restored afterwards. Fewer input tokens; Gemini cannot edit the preamble.")
+speculative_candidates = st.slider("Speculative candidates", min_value=1, max_value=MAX_CANDIDATES, value=1, key="candidates_slider",
+                                   help="Generate several candidates in parallel and keep the first that compiles. Lower latency, higher API cost. Disables streaming.")
+
+# Incremental regeneration: only send edited/selected sections and splice them into the previous result
+previous_improved_tex = st.session_state.get('improved_tex_code')
+regenerate_sections = None
+if previous_improved_tex:
+    regenerate_scope = st.radio("Regenerate", ["Whole document", "Only selected sections"], horizontal=True, key="regenerate_scope",
+                                help="Selected sections are regenerated and spliced into the current result; the rest is kept as-is. Fewer tokens, faster.")
+    if regenerate_scope == "Only selected sections":
+        base_tex_code = st.session_state.base_tex_code
+        edited_sections = changed_sections(base_tex_code, current_tex_code) if base_tex_code else []
+        regenerate_sections = st.multiselect("Sections to regenerate", section_keys(current_tex_code),
+                                             default=[key for key in edited_sections if key != PREAMBLE], key="regenerate_sections",
+                                             help="Preselected: sections you edited since the last generation.")
+        if PREAMBLE in edited_sections:
+            st.caption("ℹ️ The preamble changed; preamble edits are only applied by a whole-document regeneration.")
 
 # --- Processing Button ---
 st.divider()
@@ -114,53 +404,16 @@ if submit_button:
     st.session_state.pdf_bytes = None
     st.session_state.retry_count = 0
     st.session_state.change_summary = None # Clear summary
+    st.session_state.layout = None
     # Clear output areas
     output_area.empty()
     summary_area.empty()
 
 # Display stored LaTeX code and summary if they exist
 if st.session_state.get('improved_tex_code'): # Use .get for safety
-    with st.expander("📝 View Generated LaTeX Code", expanded=False):
-        st.code(st.session_state.improved_tex_code, language='latex')
-    st.success("✅ Improved LaTeX code generated successfully!")
-
-    # Display the summary ONLY if it exists (i.e., was requested and generated)
-    if st.session_state.get('change_summary'):
-        with st.expander("📊 Summary of Changes", expanded=True):
-             st.markdown(st.session_state.change_summary)
-
-    # Display PDF preview and download button if PDF exists
-    if st.session_state.get('pdf_bytes'):
-        st.success("✅ PDF generated successfully!")
-
-        # --- PDF Preview Expander ---
-        with st.expander("📄 Preview Generated PDF (All Pages)", expanded=False):
-            try:
-                pdf_doc = fitz.open(stream=st.session_state.pdf_bytes, filetype="pdf")
-                if pdf_doc.page_count > 0:
-                    for page_num in range(pdf_doc.page_count):
-                        # Render the current page
-                        page = pdf_doc.load_page(page_num)
-                        # Increase DPI for better quality
-                        pix = page.get_pixmap(dpi=300)
-                        img_bytes = pix.tobytes("png") # Convert pixmap to PNG bytes
-                        # Display the image
-                        st.image(io.BytesIO(img_bytes),
-                                 caption=f"Page {page_num + 1} of {pdf_doc.page_count}",
-                                 use_container_width=True)
-                else:
-                    st.warning("PDF is empty, cannot generate preview.")
-                pdf_doc.close()
-            except Exception as e:
-                st.error(f"Error generating PDF preview: {e}")
-
-        # --- Download Button ---
-        st.download_button(
-            label="📥 Download PDF",
-            data=st.session_state.pdf_bytes,
-            file_name="improved_resume.pdf",
-            mime="application/pdf"
-        )
+    render_results(st.session_state.improved_tex_code, st.session_state.get('change_summary'),
+                   st.session_state.get('pdf_bytes'), key_prefix="result", layout=st.session_state.get('layout'),
+                   job_description=st.session_state.submitted_job_description or job_description)
 
 # --- Logic ---
 if submit_button:
@@ -174,341 +427,157 @@ if submit_button:
     if not job_description:
         st.warning("Please provide a job description for tailored improvements.")
         st.stop()
+    if regenerate_sections is not None and not regenerate_sections:
+        st.warning("Please select at least one section to regenerate.")
+        st.stop()
+    st.session_state.submitted_tex_code = current_tex_code
+    st.session_state.submitted_job_description = job_description
+
+    # Capture the inputs and checkbox state at the time of submission
+    generation_request = GenerationRequest(
+        tex_code=current_tex_code,
+        job_description=job_description,
+        summary_requested=st.session_state.request_summary,
+        instructions_pdf=uploaded_pdf.getvalue() if uploaded_pdf else None,
+        instructions_pdf_name=uploaded_pdf.name if uploaded_pdf else "instructions.pdf",
+        force_regenerate=force_regenerate,
+        candidates=speculative_candidates,
+        improved_tex_code=previous_improved_tex if regenerate_sections else None,
+        regenerate_sections=regenerate_sections,
+        compact_prompt=compact_prompt,
+        max_pages=1 if fit_one_page else None,
+    )
 
-    # Reset retry count for the main generation process
-    st.session_state.retry_count = 0 # Reset for initial generation
-
-    # --- Initialize variables for cleanup ---
-    temp_pdf_path = None
-    uploaded_gemini_file = None
-    temp_dir = None
-
-    # Flag to check if API key needs verification/change
-    api_key_valid = True
-
-    # Get the checkbox state at the time of submission
-    summary_requested = st.session_state.request_summary
+    job_queue = get_job_queue()
+    if job_queue is not None:
+        # Hand off to a worker process; polled below
+        job_id = job_queue.submit(generation_request, request_api_key(), stream=st.session_state.stream_output)
+        st.session_state.current_job = job_id
+        st.query_params["job"] = job_id
+    else:
+        def show_event(kind, message):
+            # Pipeline progress -> Streamlit widgets
+            if kind == "info":
+                output_area.info(message)
+            elif kind == "warning":
+                st.warning(message)
+            elif kind == "toast":
+                st.toast(message)
+
+        def render_partial(text_so_far):
+            output_area.code(text_so_far, language='latex')
 
-    while st.session_state.retry_count < 3:  # Maximum 3 retries for LaTeX compilation
         try:
-            # --- Configure Gemini ---
-            # Configure with the key we have (either env or user)
-            genai.configure(api_key=st.session_state.api_key)
-
-            # --- Save Uploaded PDF to a Temporary File ---
-            # Only process PDF if it was uploaded
-            if uploaded_pdf and st.session_state.retry_count == 0: # Only upload on first attempt
-                output_area.info("Preparing PDF for upload...")
-                pdf_bytes_val = uploaded_pdf.getvalue()
-
-                # Create a temporary file to store the PDF bytes
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_f:
-                    temp_f.write(pdf_bytes_val)
-                    temp_pdf_path = temp_f.name
-
-                # --- Upload PDF to Gemini using the temporary file path ---
-                if temp_pdf_path:
-                    output_area.info(f"Uploading '{uploaded_pdf.name}' from temporary path...")
-                    uploaded_gemini_file = genai.upload_file(
-                        path=temp_pdf_path,
-                        display_name=uploaded_pdf.name,
-                        mime_type='application/pdf'
-                    )
-                    output_area.info(f"✅ PDF '{uploaded_pdf.name}' uploaded successfully to Gemini.")
-                    st.toast("PDF Uploaded!", icon="📄")
-                else:
-                    st.error("❌ Failed to create a temporary file for the PDF.")
-                    st.stop()
-
-            # --- Prepare for Gemini API Call ---
-            model = genai.GenerativeModel('gemini-2.5-pro-exp-03-25')
-
-            # --- Construct the Prompt --- (Conditionally add summary instructions)
-            if uploaded_pdf:
-                # Use PDF-based prompt
-                prompt_parts = [
-                    "You are an expert LaTeX resume editor specializing in ATS-friendly resumes tailored for specific job descriptions.",
-                    "You will be given the current LaTeX code for a resume, a PDF file with improvement feedback, and a target job description.",
-                    "\n**Task:** Analyze the instructions in the PDF and the requirements in the job description. Apply relevant improvements to the given LaTeX code to create an optimized, ATS-friendly version tailored for the target role.",
-                    "\n**Input Resume LaTeX Code:**\n```latex\n",
-                    current_tex_code,
-                    "\n```\n",
-                    "\n**Input Instructions PDF:**\n",
-                    uploaded_gemini_file,
-                ]
-            else:
-                # Use general instructions prompt
-                prompt_parts = [
-                    "You are an expert resume optimizer specializing in tailoring resumes to pass Applicant Tracking Systems (ATS) and appeal to recruiters.",
-                    "Your task is to revise the provided resume based on the job description. Follow these instructions precisely:",
-                    "\n**Input Resume LaTeX Code:**\n```latex\n",
-                    current_tex_code,
-                    "\n```\n",
-                    "\n**Target Job Description:**\n```text\n",
-                    job_description,
-                    "\n```\n",
-                    "\n**Instructions:**",
-                    "1. ATS Compliance & Searchability:",
-                    "- Ensure contact information is easily parsable (Name, Phone, Email, LinkedIn URL if available).",
-                    "- Find and incorporate the exact job title from the job description.",
-                    "- Include a concise summary/objective section highlighting relevant qualifications.",
-                    "- Verify presence of standard sections (Work Experience, Education) with clear headings.",
-                    "- Match education requirements if specified in the job description.",
-                    "- Use consistent date formatting (MM/YYYY or Month YYYY).",
-                    "2. Skills Integration:",
-                    "- Identify and incorporate hard skills from the job description using exact wording.",
-                    "- Weave soft skills naturally into work experience and summary.",
-                    "3. Content & Recruiter Appeal:",
-                    "- Include quantifiable achievements and results in bullet points.",
-                    "- Maintain professional, positive, and action-oriented language.",
-                    "- Keep content concise and under 1000 words for non-executive roles.",
-                    "- Ensure experience level matches job requirements.",
-                    "4. Formatting:",
-                    "- Avoid columns, tables, or images that can confuse ATS.",
-                    "- Keep bullet points and paragraphs concise (under 40 words).",
-                    "- Use standard, readable fonts.",
-                    "- Avoid information in headers/footers.",
-                ]
-
-            # Define Output Requirements based on checkbox
-            output_reqs = [
-                "\n**Output Requirements:**",
-                "- Output ONLY the complete, modified LaTeX code for the improved resume.",
-                "- Ensure the LaTeX output is valid and compilable.",
-                "- Tailor content/keywords to the job description.",
-                "- Do NOT include any conversational text, explanations, or introductions/conclusions outside the LaTeX code itself.",
-                "- Use comments within LaTeX (e.g., `% Gemini: Applied suggestion X / Tailored for JD keyword Y`) if helpful.",
-            ]
-            if summary_requested:
-                output_reqs.insert(2, "1a. After the LaTeX code block, add a separator line exactly like this: `--- SUMMARY ---`")
-                output_reqs.insert(3, "1b. After the separator, provide a brief bulleted list summarizing the key changes made based on the feedback PDF and job description (if provided). Mention specific keywords tailored if applicable.")
-                # Adjust numbering/phrasing if needed, but main point is conditional inclusion
-                output_reqs[-2] = "- Do NOT include any conversational text, explanations, or introductions/conclusions outside the LaTeX code itself OR the summary section."
-
-            formatting_reqs = [
-                "\n**Formatting Requirements:**",
-                "- Maintain ATS compatibility (standard commands, avoid complex formatting).",
-                "- Ensure excellent readability with appropriate vertical spacing (`\\vspace`, `\\itemsep`, etc.).",
-                "- Use standard fonts and maintain clear document hierarchy.",
-            ]
-
-            prompt_parts.extend(output_reqs)
-            prompt_parts.extend(formatting_reqs)
-
-            # Add error context if this is a retry (Conditionally mention summary)
-            if st.session_state.retry_count > 0:
-                error_prompt_addition = [
-                    "\n**Previous Attempt Error:**",
-                    "The previous LaTeX code failed to compile. Here are the error logs:",
-                    "```text",
-                    st.session_state.last_error,
-                    "```",
-                ]
-                if summary_requested:
-                    error_prompt_addition[-1] += " Remember to output the corrected LaTeX code followed by `--- SUMMARY ---` and a summary of changes."
-                prompt_parts.extend(error_prompt_addition)
-
-            output_area.info(f"Attempt {st.session_state.retry_count + 1}: Generating improved LaTeX code{' and summary' if summary_requested else ''}...")
             with st.spinner("🧠 Gemini is thinking..."):
-                response = model.generate_content(prompt_parts, stream=False)
-
-            # --- Process Response --- (Updated for conditional summary)
-            if response and response.text:
-                full_response_text = response.text
-                separator = "--- SUMMARY ---"
-                change_summary = None # Default to no summary
-                improved_tex_code = full_response_text # Assume full response is LaTeX initially
-
-                if summary_requested:
-                    if separator in full_response_text:
-                        parts = full_response_text.split(separator, 1)
-                        improved_tex_code = parts[0].strip()
-                        change_summary = parts[1].strip()
-                    else:
-                        # Summary was requested but separator not found
-                        st.warning("⚠️ Summary was requested, but Gemini did not provide a summary separator. Displaying full response as LaTeX.")
-                        # Keep improved_tex_code as the full response
-                        change_summary = None # Ensure summary is None
-                else:
-                    # Summary was not requested, ensure change_summary is None
-                    change_summary = None
-                    # improved_tex_code is already the full response
-
-                # Clean potential markdown code block formatting from LaTeX part
-                if improved_tex_code.startswith("```latex"):
-                     improved_tex_code = improved_tex_code[len("```latex"):].strip()
-                if improved_tex_code.endswith("```"):
-                    improved_tex_code = improved_tex_code[:-len("```")].strip()
-
-                # --- Create temporary directory for LaTeX compilation ---
-                temp_dir = tempfile.mkdtemp()
-                tex_file_path = os.path.join(temp_dir, "resume.tex")
-                pdf_file_path = os.path.join(temp_dir, "resume.pdf")
-
-                # --- Write the LaTeX code to a file ---
-                with open(tex_file_path, "w") as f:
-                    f.write(improved_tex_code)
-
-                # --- Compile LaTeX to PDF ---
-                try:
-                    # Run pdflatex and capture output
-                    result = subprocess.run(
-                        ["pdflatex", "-interaction=nonstopmode", "-output-directory", temp_dir, tex_file_path],
-                        capture_output=True,
-                        text=True,
-                        check=False  # Don't raise exception immediately
-                    )
-                    
-                    # --- Check if PDF was generated ---
-                    if os.path.exists(pdf_file_path):
-                        # --- Read the PDF file ---
-                        with open(pdf_file_path, "rb") as pdf_file:
-                            pdf_bytes = pdf_file.read()
-                        
-                        # Store results in session state (conditionally includes summary)
-                        st.session_state.improved_tex_code = improved_tex_code
-                        st.session_state.pdf_bytes = pdf_bytes
-                        st.session_state.change_summary = change_summary # Store None if no summary
-                        
-                        # Display the results
-                        with st.expander("📝 View Generated LaTeX Code", expanded=False):
-                            st.code(improved_tex_code, language='latex')
-                        st.success("✅ Improved LaTeX code generated successfully!")
-
-                        # Display the summary
-                        if st.session_state.get('change_summary'):
-                            with st.expander("📊 Summary of Changes", expanded=True):
-                                 st.markdown(st.session_state.change_summary)
-                        summary_area.empty() # Clear placeholder if successful
-
-                        st.toast("Generation Complete!", icon="🎉")
-
-                        # --- PDF Preview Expander (Success Case) ---
-                        st.success("✅ PDF generated successfully!")
-                        with st.expander("📄 Preview Generated PDF (All Pages)", expanded=False):
-                            try:
-                                pdf_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-                                if pdf_doc.page_count > 0:
-                                    for page_num in range(pdf_doc.page_count):
-                                        # Render the current page
-                                        page = pdf_doc.load_page(page_num)
-                                        # Increase DPI for better quality
-                                        pix = page.get_pixmap(dpi=300)
-                                        img_bytes = pix.tobytes("png") # Convert pixmap to PNG bytes
-                                        # Display the image
-                                        st.image(io.BytesIO(img_bytes),
-                                                 caption=f"Page {page_num + 1} of {pdf_doc.page_count}",
-                                                 use_container_width=True)
-                                else:
-                                    st.warning("PDF is empty, cannot generate preview.")
-                                pdf_doc.close()
-                            except Exception as e:
-                                st.error(f"Error generating PDF preview: {e}")
-
-                        # Create download button
-                        st.download_button(
-                            label="📥 Download PDF",
-                            data=pdf_bytes,
-                            file_name="improved_resume.pdf",
-                            mime="application/pdf"
-                        )
-                        api_key_valid = True # Key worked for this generation
-                        break # Exit the while loop for retries
-                    else:
-                        # Store error information for retry
-                        error_msg = "LaTeX Compilation Errors:\n"
-                        if result.stdout:
-                            error_msg += f"Output:\n{result.stdout}\n"
-                        if result.stderr:
-                            error_msg += f"Errors:\n{result.stderr}\n"
-                        if result.returncode != 0:
-                            error_msg += f"Return code: {result.returncode}"
-                        st.session_state.last_error = error_msg
-                        
-                        # Increment retry count
-                        st.session_state.retry_count += 1
-                        
-                        if st.session_state.retry_count < 3:
-                            st.warning(f"⚠️ LaTeX compilation failed. Retrying with error context... (Attempt {st.session_state.retry_count}/3)")
-                            time.sleep(2)  # Brief pause before retry
-                        else:
-                            st.error("❌ Maximum retries reached. Please check the LaTeX code for errors.")
-                            st.text("LaTeX Compilation Output:")
-                            st.code(result.stdout, language="text")
-                            st.text("LaTeX Compilation Errors:")
-                            st.code(result.stderr, language="text")
-                            if result.returncode != 0:
-                                st.error(f"❌ LaTeX compilation failed with return code {result.returncode}")
-                except Exception as e:
-                    st.error(f"❌ Error generating PDF: {e}")
-                    break
-
-            # --- Handle potential empty response from Gemini ---
-            elif not response or not response.text:
-                 # Check for safety ratings or other issues if text is empty
-                 try:
-                      # Log feedback if available
-                      feedback_info = f"Finish reason: {response.prompt_feedback}" if response else "No response object."
-                      output_area.error(f"❌ Gemini did not return text content. {feedback_info}")
-                 except Exception as feedback_err:
-                      output_area.error(f"❌ Gemini did not return text content. Error accessing feedback: {feedback_err}")
-                 api_key_valid = False # Treat no response as potential key issue too
-                 break # Exit retry loop if Gemini gives no content
+                result = get_pipeline().run(
+                    generation_request,
+                    api_key=request_api_key(), # The user's key, or None to lease one from the key pool
+                    stream=st.session_state.stream_output,
+                    on_text=render_partial,
+                    on_event=show_event,
+                )
 
         # --- Handle API specific errors ---
         except (google_exceptions.PermissionDenied, google_exceptions.ResourceExhausted) as api_error:
-            st.error(f"API Error: {api_error}")
-            api_key_valid = False # Mark key as invalid
-            if st.session_state.api_source == 'env':
-                st.warning("⚠️ The default API key failed (Permission Denied or Rate Limit Exceeded). Please enter your own key below.")
-                st.session_state.show_api_input = True
-                st.session_state.api_key = None # Clear the invalid env key
-                st.session_state.api_source = None # Reset source
-                st.experimental_rerun() # Rerun to show input and stop current execution
-            else: # Error occurred with user-provided key
-                st.error("❌ Your provided API key failed. Please check it and try again.")
-                # Optionally clear the key input or leave it for user correction
-                st.session_state.api_key = None # Clear the invalid user key
-                st.session_state.api_source = None
-                st.session_state.show_api_input = True # Make sure input is shown
-                st.experimental_rerun() # Rerun to ensure UI updates
-            break # Exit retry loop on API error
+            handle_api_key_failure(api_error, isinstance(api_error, google_exceptions.ResourceExhausted))
 
         # --- Handle other general exceptions ---
         except Exception as e:
             st.error(f"An unexpected error occurred: {e}")
             output_area.error(f"❌ Failed during generation. Error: {e}")
-            api_key_valid = False # Unsure about key validity, but stop
-            break # Exit retry loop on general error
-
-        finally:
-            # --- Clean up ---
-            # Clean up local temp PDF regardless of success/failure inside the loop
-            if temp_pdf_path and os.path.exists(temp_pdf_path):
-                try:
-                    os.remove(temp_pdf_path)
-                    temp_pdf_path = None # Reset path after deletion
-                except Exception as e:
-                    st.warning(f"⚠️ Could not delete the local temporary file: {e}")
-
-            # Clean up LaTeX temp dir if it exists
-            if temp_dir and os.path.exists(temp_dir):
-                try:
-                    shutil.rmtree(temp_dir)
-                    temp_dir = None # Reset path
-                except Exception as e:
-                    st.warning(f"⚠️ Could not delete temporary LaTeX directory: {e}")
-
-    # --- After the retry loop ---
-    # Clean up the file uploaded to GEMINI only if one was uploaded
-    if uploaded_gemini_file:
-        try:
-            st.info(f"Cleaning up file '{uploaded_gemini_file.display_name}' on Gemini...")
-            genai.delete_file(uploaded_gemini_file.name)
-            st.info("✅ Gemini file cleanup complete.")
-            st.toast("Gemini file cleanup done.", icon="🗑️")
-        except Exception as cleanup_err:
-            st.warning(f"⚠️ Could not delete the file from Gemini: {cleanup_err}")
+
+        else:
+            show_generation_result(result)
+
+# --- Background Job ---
+current_job = st.session_state.current_job
+if get_job_queue() is not None and current_job and current_job != st.session_state.shown_job:
+    job = wait_for_job(get_job_queue(), current_job)
+    st.session_state.shown_job = current_job
+    if job is None:
+        # Purged after the retention period
+        st.session_state.current_job = None
+        st.query_params.pop("job", None)
+    elif job.error_type in ("PermissionDenied", "ResourceExhausted"):
+        st.query_params.pop("job", None)
+        handle_api_key_failure(job.error, job.error_type == "ResourceExhausted")
+    elif job.error_type:
+        st.error(f"An unexpected error occurred: {job.error}")
+        output_area.error(f"❌ Failed during generation. Error: {job.error}")
+    else:
+        show_generation_result(job.to_result())
+
+# --- Batch Mode ---
+st.divider()
+with st.expander("📦 Batch Mode: tailor this resume to many job descriptions", expanded=False):
+    st.caption("Each job description is tailored independently using the resume LaTeX above. The instructions PDF is not used in batch mode.")
+    batch_files = st.file_uploader("Upload job descriptions (.txt or .md, one posting per file):", type=["txt", "md"],
+                                   accept_multiple_files=True, key="batch_upload")
+    batch_concurrency = st.slider("Concurrent Gemini requests", min_value=1, max_value=8, value=DEFAULT_CONCURRENCY, key="batch_concurrency")
+    if st.button("📦 Run Batch", key="batch_button"):
+        batch_jobs = [
+            BatchJob(Path(batch_file.name).stem, batch_file.getvalue().decode("utf-8", errors="replace").strip())
+            for batch_file in (batch_files or [])
+        ]
+        batch_jobs = [job for job in batch_jobs if job.job_description]
+        if not st.session_state.api_key:
+            st.warning("Please provide a Google AI API Key.")
+        elif not current_tex_code:
+            st.warning("Please paste your current resume's LaTeX code.")
+        elif not batch_jobs:
+            st.warning("Please upload at least one job description.")
+        else:
+            batch_progress = st.progress(0.0, text=f"Tailoring 0/{len(batch_jobs)}...")
+            batch_results = []
+            for batch_result in iter_batch(current_tex_code, batch_jobs, get_compile_engine(), get_generation_cache(),
+                                           st.session_state.request_summary, batch_concurrency, metrics=get_metrics(),
+                                           api_key=request_api_key(), key_pool=get_key_pool()):
+                batch_results.append(batch_result)
+                batch_progress.progress(len(batch_results) / len(batch_jobs),
+                                        text=f"Tailoring {len(batch_results)}/{len(batch_jobs)}... (finished '{batch_result.name}')")
+            st.session_state.batch_zip = build_zip(batch_results)
+            succeeded = sum(1 for batch_result in batch_results if batch_result.succeeded)
+            batch_progress.progress(1.0, text=f"✅ Done: {succeeded}/{len(batch_results)} compiled successfully.")
+
+    if st.session_state.get('batch_zip'):
+        st.download_button(
+            label="📥 Download Batch Results (.zip)",
+            data=st.session_state.batch_zip,
+            file_name="tailored_resumes.zip",
+            mime="application/zip"
+        )
+
+# --- Run Metrics ---
+with st.expander("⏱️ Run Metrics (debug)", expanded=False):
+    recent_runs = list(reversed(get_metrics().recent_runs(20)))
+    if not recent_runs:
+        st.caption("No runs recorded yet since this server started.")
+    else:
+        rows = []
+        for run in recent_runs:
+            row = {
+                "run": run["run_id"],
+                "outcome": run["outcome"],
+                "total s": run["seconds"],
+                "attempts": run.get("attempts", 0),
+                "prompt tokens": run.get("prompt_tokens", 0),
+                "output tokens": run.get("output_tokens", 0),
+            }
+            # Stages can repeat across attempts; show their summed time
+            for stage in run["stages"]:
+                column = f"{stage['stage']} s"
+                row[column] = round(row.get(column, 0) + stage["seconds"], 4)
+            rows.append(row)
+        st.dataframe(rows, use_container_width=True)
+    if get_key_pool() is not None and get_job_queue() is not None:
+        # Each worker process leases from its own share of the keys
+        st.caption("API key headroom per background worker")
+        st.dataframe(get_job_queue().key_headroom(), use_container_width=True)
+    elif get_key_pool() is not None:
+        st.caption("API key headroom")
+        st.dataframe(get_key_pool().headroom(), use_container_width=True)
+    if st.toggle("Show Prometheus metrics", value=False, key="show_prometheus"):
+        st.code(get_metrics().prometheus_text(), language="text")
 
 # --- Footer/Info ---
 st.markdown("---")
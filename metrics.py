@@ -0,0 +1,205 @@
+"""Per-stage timing spans for generation runs, with JSON and Prometheus-style exports.
+
+A run is traced with `recorder.start_run()`; each stage is wrapped in
+`trace.span(name, **attrs)`. Finished runs are kept in memory (last N),
+logged as one JSON line each (optionally appended to a file sink), passed
+to any registered sinks and aggregated into counters and histograms served
+as Prometheus text. Runs recorded in another process (background workers)
+are folded in with `record(summary, log=False)`.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Configuration ---
+DEFAULT_HISTORY = 50
+LOG_RUNS = os.getenv("RESUME_METRICS_LOG", "1") != "0" # One JSON line per run on stdout
+METRICS_FILE = os.getenv("RESUME_METRICS_FILE") # JSONL sink, disabled when unset
+METRICS_PORT = os.getenv("RESUME_METRICS_PORT") # Prometheus endpoint, disabled when unset
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+logger = logging.getLogger("resume_improv.metrics")
+if LOG_RUNS and not logger.handlers:
+    # Nothing else configures logging, and the last-resort handler drops INFO
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class RunTrace:
+    def __init__(self, recorder, kind):
+        self.recorder = recorder
+        self.run_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.stages = []
+        self.attrs = {}
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        """Time a stage. The yielded dict can be updated with extra attributes (e.g. token counts)."""
+        record = {"stage": stage, **attrs}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            self.stages.append(record)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, outcome):
+        summary = {
+            "run_id": self.run_id,
+            "kind": self.kind,
+            "started": self.started,
+            "seconds": round(time.perf_counter() - self._start, 4),
+            "outcome": outcome,
+            **self.attrs,
+            "stages": self.stages,
+        }
+        self.recorder.record(summary)
+        return summary
+
+
+class NullTrace:
+    """Stand-in used when a stage runs outside a traced run."""
+    run_id = None
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        yield {}
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self, outcome):
+        return {}
+
+
+NULL_TRACE = NullTrace()
+
+
+class MetricsRecorder:
+    def __init__(self, history=DEFAULT_HISTORY, file_path=METRICS_FILE):
+        self.file_path = file_path
+        self._runs = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {} # stage -> [bucket counts..., +Inf count, sum]
+        self._collectors = [] # Callables returning extra Prometheus lines (e.g. key pool headroom)
+        self._sinks = [] # Callables receiving each run logged here (e.g. the job queue, in worker processes)
+
+    def start_run(self, kind="generation"):
+        return RunTrace(self, kind)
+
+    def observe(self, stage, seconds):
+        """Record a standalone timing outside any run (e.g. preview rendering)."""
+        with self._lock:
+            self._observe(stage, seconds)
+
+    def _observe(self, stage, seconds):
+        histogram = self._histograms.setdefault(stage, [0] * (len(BUCKETS) + 2) + [0.0])
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[index] += 1
+        histogram[len(BUCKETS)] += 1 # +Inf
+        histogram[-1] += seconds
+
+    def record(self, summary, log=True):
+        """Aggregate a finished run; `log=False` for runs already logged by the process that ran them."""
+        with self._lock:
+            self._runs.append(summary)
+            self._counters[("runs_total", summary["outcome"])] += 1
+            self._counters[("attempts_total", "")] += summary.get("attempts", 0)
+            self._counters[("prompt_tokens_total", "")] += summary.get("prompt_tokens", 0)
+            self._counters[("output_tokens_total", "")] += summary.get("output_tokens", 0)
+            self._observe("run", summary["seconds"])
+            for stage in summary["stages"]:
+                self._observe(stage["stage"], stage["seconds"])
+        if not log:
+            return
+
+        line = json.dumps(summary, default=str)
+        logger.info(line)
+        if self.file_path:
+            try:
+                with self._lock, open(self.file_path, "a") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                logger.warning("Could not write metrics file %s: %s", self.file_path, e)
+        for sink in self._sinks:
+            try:
+                sink(summary)
+            except Exception as e:
+                logger.warning("Metrics sink %r failed: %s", sink, e)
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    def recent_runs(self, limit=None):
+        with self._lock:
+            runs = list(self._runs)
+        return runs[-limit:] if limit else runs
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {stage: list(values) for stage, values in self._histograms.items()}
+
+        lines.append("# TYPE resume_runs_total counter")
+        for (name, label), value in sorted(counters.items()):
+            if name == "runs_total":
+                lines.append(f'resume_runs_total{{outcome="{label}"}} {value:g}')
+        for name in ("attempts_total", "prompt_tokens_total", "output_tokens_total"):
+            lines.append(f"# TYPE resume_{name} counter")
+            lines.append(f"resume_{name} {counters.get((name, ''), 0):g}")
+
+        lines.append("# TYPE resume_stage_seconds histogram")
+        for stage, values in sorted(histograms.items()):
+            for index, bound in enumerate(BUCKETS):
+                lines.append(f'resume_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {values[index]}')
+            lines.append(f'resume_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {values[len(BUCKETS)]}')
+            lines.append(f'resume_stage_seconds_sum{{stage="{stage}"}} {values[-1]:.4f}')
+            lines.append(f'resume_stage_seconds_count{{stage="{stage}"}} {values[len(BUCKETS)]}')
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(recorder, port):
+    """Serve `recorder.prometheus_text()` at http://0.0.0.0:<port>/metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = recorder.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Keep scrapes out of the app log
+
+    server = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,72 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import fitz # PyMuPDF
+
+# --- Configuration ---
+THUMBNAIL_DPI = 72
+FULL_DPI = 200
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+MAX_PAGE_COUNTS = 1024
+
+
+def pdf_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+class PreviewCache:
+    """Rendered PNG pages keyed by (pdf hash, page, dpi), evicted LRU once over `max_bytes`."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._page_counts = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def page_count(self, pdf_bytes, digest=None):
+        digest = digest or pdf_hash(pdf_bytes)
+        with self._lock:
+            if digest in self._page_counts:
+                return self._page_counts[digest]
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+            count = pdf_doc.page_count
+        self._store_page_count(digest, count)
+        return count
+
+    def _store_page_count(self, digest, count):
+        with self._lock:
+            self._page_counts[digest] = count
+            if len(self._page_counts) > MAX_PAGE_COUNTS:
+                self._page_counts.pop(next(iter(self._page_counts)))
+
+    def render_page(self, pdf_bytes, page_num, dpi=THUMBNAIL_DPI, digest=None):
+        """Return PNG bytes for one page, rendering it only on a cache miss."""
+        digest = digest or pdf_hash(pdf_bytes)
+        key = (digest, page_num, dpi)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+
+        with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+            page = pdf_doc.load_page(page_num)
+            img_bytes = page.get_pixmap(dpi=dpi).tobytes("png")
+        self._store_image(key, img_bytes)
+        return img_bytes
+
+    def _store_image(self, key, img_bytes):
+        with self._lock:
+            if key not in self._images:
+                self._images[key] = img_bytes
+                self._total_bytes += len(img_bytes)
+                while self._total_bytes > self.max_bytes and len(self._images) > 1:
+                    _, evicted = self._images.popitem(last=False)
+                    self._total_bytes -= len(evicted)
+
+    def store(self, digest, page_num, dpi, img_bytes, page_count=None):
+        """Add a page rendered elsewhere (e.g. the export thumbnail) so previews reuse it."""
+        self._store_image((digest, page_num, dpi), img_bytes)
+        if page_count is not None:
+            self._store_page_count(digest, page_count)
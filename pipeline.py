@@ -0,0 +1,595 @@
+"""Headless resume generation pipeline, independent of Streamlit.
+
+Stages, in order:
+    build_prompt -> upload_instructions (reused via the file registry) -> call_model -> parse -> compile (+ local fix,
+    targeted repair) -> layout check -> retry with error context -> cleanup; previews and exports (text,
+    Markdown, ATS keyword match) are built on demand.
+
+`ResumePipeline.run` drives the stages for one GenerationRequest and returns a
+GenerationResult. Progress is reported through an optional `on_event(kind, message)`
+callback (`kind` is "info", "warning" or "toast") so any front end can display it.
+"""
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
+from typing import Callable, List, Optional
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+from compaction import (CompactionReport, compact_latex, estimate_tokens, preamble_note, restore_latex,
+                        strip_comments_and_whitespace)
+from exports import ExportBundle, ExportCache, ats_match
+from gemini_files import upload_pdf_bytes
+from key_pool import KeyedModel, using_key
+from generation_cache import generation_key, pdf_content_hash
+from latex_compiler import CompileResult
+from latex_fixer import autofix_and_compile, sanitize_latex
+from latex_repair import attempt_targeted_repair
+from layout_check import LayoutReport, analyze_layout, tighten_to_fit
+from metrics import NULL_TRACE, MetricsRecorder
+from pdf_preview import THUMBNAIL_DPI
+from prompts import INSTRUCTIONS_PDF_PLACEHOLDER, MODEL_NAME, build_prompt_parts, resolve_instructions_pdf
+from response_parser import SUMMARY_SEPARATOR, parse_response
+from sections import (PREAMBLE, Section, build_section_prompt_parts, macro_signatures, parse_section_response,
+                      splice_sections, split_sections, unmatched_sections)
+from streaming import stream_response
+
+# --- Configuration ---
+MAX_ATTEMPTS = 3 # Maximum attempts for LaTeX compilation
+RETRY_DELAY = 2.0 # Brief pause before a full regeneration, in seconds
+RATE_LIMIT_BASE_DELAY = 2.0 # Seconds; doubled on each consecutive 429
+MAX_CANDIDATES = 4
+# Temperature per speculative candidate (None keeps the model default), so parallel candidates differ
+SPECULATIVE_TEMPERATURES = (None, 0.4, 0.8, 1.2)
+
+
+@dataclass
+class GenerationRequest:
+    tex_code: str
+    job_description: str
+    summary_requested: bool = False
+    instructions_pdf: Optional[bytes] = None
+    instructions_pdf_name: str = "instructions.pdf"
+    force_regenerate: bool = False
+    candidates: int = 1 # >1 generates that many candidates in parallel on the first attempt
+    # Incremental regeneration: only these section keys (see sections.py) are sent to Gemini and
+    # spliced into `improved_tex_code`, the previous output. None regenerates the whole document.
+    improved_tex_code: Optional[str] = None
+    regenerate_sections: Optional[List[str]] = None
+    compact_prompt: bool = True # Strip comments/whitespace and stand in for the preamble (see compaction.py)
+    max_pages: Optional[int] = 1 # Page budget; small overflows are tightened locally. None disables the check
+
+
+@dataclass
+class ModelResponse:
+    text: str
+    from_cache: bool = False
+    early_tex_code: Optional[str] = None # LaTeX already submitted for compilation while streaming
+    early_compile: Optional[object] = None # Future[CompileResult]
+    prompt_feedback: Optional[object] = None
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    candidates: int = 1 # Candidates received when speculating
+    cache_key: Optional[str] = None # Generation cache key; the text is only stored once it compiles
+
+
+@dataclass
+class GenerationResult:
+    tex_code: Optional[str] = None
+    pdf_bytes: Optional[bytes] = None
+    change_summary: Optional[str] = None
+    summary_missing: bool = False # Summary requested but no separator in the response
+    attempts: int = 0
+    error: Optional[str] = None
+    compile_result: Optional[CompileResult] = None
+    run_id: Optional[str] = None # Matches the run's metrics record
+    compaction: Optional[CompactionReport] = None # Estimated prompt token savings
+    layout: Optional[LayoutReport] = None # Page count, fill and warnings of the final PDF
+
+    @property
+    def succeeded(self):
+        return self.pdf_bytes is not None
+
+
+def generate_with_backoff(model, prompt_parts, retries=0, base_delay=RATE_LIMIT_BASE_DELAY, **kwargs):
+    """Call `generate_content`, retrying ResourceExhausted (429) with jittered exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return model.generate_content(prompt_parts, **kwargs)
+        except google_exceptions.ResourceExhausted:
+            if attempt == retries:
+                raise
+            time.sleep(base_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def token_usage(response):
+    """(prompt_tokens, output_tokens) from a response's usage metadata, or zeros if unavailable."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0
+
+
+def response_text(response):
+    """Text of a non-streamed response, or "" when Gemini returned no text (e.g. blocked)."""
+    try:
+        return response.text if response else ""
+    except ValueError:
+        return ""
+
+
+class ResumePipeline:
+    def __init__(self, compile_engine, generation_cache=None, preview_cache=None, file_registry=None,
+                 model_name=MODEL_NAME, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, rate_limit_retries=0,
+                 metrics=None, model_factory=None, janitor=None, key_pool=None, export_cache=None):
+        self.model_factory = model_factory or genai.GenerativeModel # Swapped for a stand-in by benchmark.py
+        self.metrics = metrics if metrics is not None else MetricsRecorder()
+        self.compile_engine = compile_engine
+        self.generation_cache = generation_cache
+        self.preview_cache = preview_cache
+        self.file_registry = file_registry
+        self.model_name = model_name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.rate_limit_retries = rate_limit_retries
+        self.janitor = janitor # Background cleanup (janitor.Janitor); without one, cleanup runs inline
+        self.key_pool = key_pool # key_pool.ApiKeyPool used for runs that are not given an explicit key
+        self.export_cache = export_cache if export_cache is not None else ExportCache()
+
+    # --- Stages ---
+
+    def sections_to_regenerate(self, request: GenerationRequest):
+        """Sections of the input to send for an incremental regeneration; [] means regenerate everything."""
+        if not request.improved_tex_code or not request.regenerate_sections:
+            return []
+        if not split_sections(request.improved_tex_code) or self.section_mismatch(request):
+            return []
+        wanted = set(request.regenerate_sections) - {PREAMBLE}
+        return [section for section in split_sections(request.tex_code) if section.key in wanted]
+
+    def section_mismatch(self, request: GenerationRequest) -> List[str]:
+        """Selected sections that cannot be matched to the previous output; non-empty forces a full regeneration."""
+        if not request.improved_tex_code or not request.regenerate_sections:
+            return []
+        wanted = [key for key in request.regenerate_sections if key != PREAMBLE]
+        return unmatched_sections(request.tex_code, request.improved_tex_code, wanted)
+
+    def compaction(self, request: GenerationRequest):
+        """CompactedLatex of the input for a whole-document prompt, or None when compaction is off."""
+        return compact_latex(request.tex_code) if request.compact_prompt else None
+
+    def compaction_report(self, request: GenerationRequest) -> Optional[CompactionReport]:
+        if not request.compact_prompt:
+            return None
+        sections = self.sections_to_regenerate(request)
+        if sections:
+            original = "".join(section.text for section in sections)
+            return CompactionReport(estimate_tokens(original), estimate_tokens(strip_comments_and_whitespace(original)))
+        return self.compaction(request).report
+
+    def build_prompt(self, request: GenerationRequest, last_error: Optional[str] = None) -> List:
+        """Prompt with a placeholder for the instructions PDF, filled in by `call_model`."""
+        sections = self.sections_to_regenerate(request)
+        if sections:
+            if request.compact_prompt:
+                sections = [Section(section.key, strip_comments_and_whitespace(section.text)) for section in sections]
+            # The instructions PDF is only used for full regenerations
+            return build_section_prompt_parts(
+                sections,
+                request.job_description,
+                request.summary_requested,
+                macros=macro_signatures(split_sections(request.tex_code)[0].text),
+                last_error=last_error,
+            )
+        compacted = self.compaction(request)
+        prompt_parts = build_prompt_parts(
+            compacted.text if compacted else request.tex_code,
+            request.job_description,
+            request.summary_requested,
+            instructions_pdf=INSTRUCTIONS_PDF_PLACEHOLDER if request.instructions_pdf else None,
+            last_error=last_error,
+        )
+        if compacted and compacted.preamble:
+            prompt_parts.append(preamble_note(compacted.preamble))
+        return prompt_parts
+
+    def upload_instructions(self, request: GenerationRequest, api_key: Optional[str] = None, on_event=None):
+        """Return (remote_file, owned) for the instructions PDF.
+
+        With a file registry the handle is shared across requests and `owned`
+        is False; otherwise the file is uploaded for this run only and must be
+        deleted by `cleanup`.
+        """
+        emit = on_event or (lambda kind, message: None)
+        if self.file_registry is not None:
+            remote_file, reused = self.file_registry.get_or_upload(request.instructions_pdf, request.instructions_pdf_name, api_key)
+            emit("toast", "Reusing previously uploaded PDF." if reused else "PDF Uploaded!")
+            return remote_file, False
+        with using_key(api_key):
+            remote_file = upload_pdf_bytes(request.instructions_pdf, request.instructions_pdf_name)
+        emit("toast", "PDF Uploaded!")
+        return remote_file, True
+
+    def call_model(self, model, prompt_parts: List, request: GenerationRequest, get_uploaded_file=None,
+                   stream=False, on_text: Optional[Callable[[str], None]] = None, trace=NULL_TRACE,
+                   candidates=1) -> ModelResponse:
+        """Return Gemini's response for `prompt_parts`, from the generation cache when possible.
+
+        `get_uploaded_file()` supplies the remote instructions PDF; it is only
+        called on a cache miss, so cached responses never pay for an upload.
+        Fresh responses are not cached here: `run` calls `remember` once it
+        knows whether the LaTeX compiles.
+        With `candidates` > 1 the response comes from `speculate` (no streaming).
+        """
+        key = generation_key(prompt_parts, self.model_name, pdf_content_hash(request.instructions_pdf))
+        if self.generation_cache is not None and not request.force_regenerate:
+            with trace.span("cache_lookup") as span:
+                cached_text = self.generation_cache.get(key)
+                span["hit"] = cached_text is not None
+            if cached_text is not None:
+                return ModelResponse(cached_text, from_cache=True, cache_key=key)
+
+        needs_upload = any(part is INSTRUCTIONS_PDF_PLACEHOLDER for part in prompt_parts)
+        uploaded_file = get_uploaded_file() if get_uploaded_file and needs_upload else None
+        prompt_parts = resolve_instructions_pdf(prompt_parts, uploaded_file)
+        if candidates > 1:
+            model_response = self.speculate(model, prompt_parts, request, candidates, trace)
+            model_response.cache_key = key
+            return model_response
+
+        model_response = ModelResponse("", cache_key=key)
+        with trace.span("generate", stream=stream) as span:
+            if stream:
+                compacted = self.compaction(request)
+
+                def start_early_compile(tex_code):
+                    span["latex_complete_after"] = round(time.perf_counter() - started, 4)
+                    if compacted:
+                        tex_code = restore_latex(tex_code, compacted)
+                    tex_code, _ = sanitize_latex(tex_code)
+                    model_response.early_tex_code = tex_code
+                    model_response.early_compile = self.compile_engine.submit(tex_code)
+
+                started = time.perf_counter()
+                response = generate_with_backoff(model, prompt_parts, self.rate_limit_retries, stream=True)
+                model_response.text = stream_response(response, on_text=on_text, on_latex_complete=start_early_compile)
+            else:
+                response = generate_with_backoff(model, prompt_parts, self.rate_limit_retries, stream=False)
+                model_response.text = response_text(response)
+            model_response.prompt_feedback = getattr(response, "prompt_feedback", None)
+            model_response.prompt_tokens, model_response.output_tokens = token_usage(response)
+            span.update(prompt_tokens=model_response.prompt_tokens, output_tokens=model_response.output_tokens)
+        return model_response
+
+    def remember(self, response: ModelResponse, compiled: CompileResult):
+        """Cache a response once its LaTeX has compiled; drop a cached one that no longer does."""
+        if self.generation_cache is None or not response.cache_key or not response.text:
+            return
+        if compiled.succeeded and not response.from_cache:
+            self.generation_cache.set(response.cache_key, response.text)
+        elif not compiled.succeeded and response.from_cache:
+            self.generation_cache.delete(response.cache_key)
+
+    def speculate(self, model, prompt_parts: List, request: GenerationRequest, candidates: int,
+                  trace=NULL_TRACE) -> ModelResponse:
+        """Generate `candidates` responses in parallel and compile each one as soon as it arrives.
+
+        Returns the first candidate that compiles cleanly, or the first one
+        received if none does, with its compile attached as `early_compile`
+        so `compile` picks it up. Remaining candidates are abandoned: queued
+        compiles are cancelled and late responses are ignored. All calls start
+        at once, so an abandoned call has already been sent and is billed; the
+        span counts them as `abandoned` (their tokens are unknown).
+        """
+        candidates = min(candidates, MAX_CANDIDATES)
+
+        def generate(temperature):
+            kwargs = {"generation_config": {"temperature": temperature}} if temperature is not None else {}
+            return generate_with_backoff(model, prompt_parts, self.rate_limit_retries, stream=False, **kwargs)
+
+        executor = ThreadPoolExecutor(max_workers=candidates, thread_name_prefix="speculate")
+        with trace.span("speculate", candidates=candidates) as span:
+            generations = [executor.submit(generate, SPECULATIVE_TEMPERATURES[index % len(SPECULATIVE_TEMPERATURES)])
+                           for index in range(candidates)]
+            pending = set(generations)
+            compiling = {} # compile future -> candidate ModelResponse
+            received, winner, errors = [], None, []
+            prompt_feedback = None
+            try:
+                while pending and winner is None:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in compiling:
+                            if future.result().succeeded:
+                                winner = compiling[future]
+                                break
+                            continue
+                        try:
+                            response = future.result()
+                        except Exception as e:
+                            errors.append(e)
+                            continue
+                        candidate = ModelResponse(response_text(response))
+                        candidate.prompt_tokens, candidate.output_tokens = token_usage(response)
+                        prompt_feedback = getattr(response, "prompt_feedback", None)
+                        if not candidate.text:
+                            continue
+                        received.append(candidate)
+                        candidate.early_tex_code, _, _ = self.parse(candidate, request) # Same text `run` will compile
+                        candidate.early_compile = self.compile_engine.submit(candidate.early_tex_code)
+                        compiling[candidate.early_compile] = candidate
+                        pending.add(candidate.early_compile)
+            finally:
+                for future in pending:
+                    future.cancel()
+                executor.shutdown(wait=False, cancel_futures=True)
+
+            # Finished calls are paid for whether or not their response was looked at
+            usage = [token_usage(future.result()) for future in generations
+                     if future.done() and not future.cancelled() and future.exception() is None]
+            prompt_tokens = sum(prompt for prompt, _ in usage)
+            output_tokens = sum(output for _, output in usage)
+            span.update(received=len(received), won=winner is not None,
+                        abandoned=sum(1 for future in generations if not future.done()),
+                        prompt_tokens=prompt_tokens, output_tokens=output_tokens)
+
+        if not received:
+            if errors:
+                raise errors[0] # e.g. PermissionDenied, handled by the caller like a single call
+            return ModelResponse("", prompt_feedback=prompt_feedback)
+        chosen = winner or received[0]
+        chosen.candidates = len(received)
+        chosen.prompt_tokens, chosen.output_tokens = prompt_tokens, output_tokens
+        return chosen
+
+    def parse(self, response: ModelResponse, request: GenerationRequest, on_event=None):
+        """Split the response into (tex_code, change_summary, summary_missing) and clean the LaTeX."""
+        emit = on_event or (lambda kind, message: None)
+        tex_code, change_summary = parse_response(response.text, request.summary_requested)
+        summary_missing = request.summary_requested and SUMMARY_SEPARATOR not in response.text
+        sections = self.sections_to_regenerate(request)
+        if sections:
+            # From the raw response: `parse_response` strips the last block's closing fence
+            section_text = response.text.split(SUMMARY_SEPARATOR, 1)[0]
+            replacements = parse_section_response(section_text, [section.key for section in sections])
+            missing = [section for section in sections if section.key not in replacements]
+            if missing:
+                emit("warning", f"⚠️ Gemini did not return {', '.join(s.key for s in missing)}; using your edited version as-is.")
+                replacements.update({section.key: section.text for section in missing})
+            tex_code = splice_sections(request.improved_tex_code, request.tex_code, replacements)
+        elif request.compact_prompt:
+            tex_code = restore_latex(tex_code, self.compaction(request))
+        # --- Clean up common LLM artifacts (stray fences, bare percent signs, markdown bold) ---
+        tex_code, sanitize_fixes = sanitize_latex(tex_code)
+        if sanitize_fixes:
+            emit("toast", f"Cleaned up LaTeX: {', '.join(sanitize_fixes)}.")
+        return tex_code, change_summary, summary_missing
+
+    def compile(self, model, tex_code: str, response: Optional[ModelResponse] = None, on_event=None, trace=NULL_TRACE):
+        """Compile, then try local fixes and a targeted Gemini repair. Returns (tex_code, CompileResult)."""
+        emit = on_event or (lambda kind, message: None)
+        early = response is not None and response.early_compile is not None and response.early_tex_code == tex_code
+        with trace.span("compile", early=early) as span:
+            if early:
+                # Compilation already started while the response was streaming
+                result = response.early_compile.result()
+            else:
+                result = self.compile_engine.compile(tex_code)
+            span.update(cached=result.cached, succeeded=result.succeeded)
+        if result.cached:
+            emit("toast", "Reused cached PDF for identical LaTeX.")
+
+        # --- Local auto-fix: mechanical errors are repaired without calling Gemini ---
+        if not result.succeeded:
+            with trace.span("autofix") as span:
+                fix = autofix_and_compile(tex_code, result.log, self.compile_engine.compile)
+                span["succeeded"] = bool(fix and fix.result.succeeded)
+            if fix:
+                # Keep partial progress too; fewer errors are left for Gemini to repair
+                tex_code, result = fix.tex_code, fix.result
+                if result.succeeded:
+                    emit("toast", f"Fixed compile errors locally: {', '.join(fix.applied)}.")
+
+        # --- Targeted repair: send only the failing lines back to Gemini ---
+        if not result.succeeded:
+            emit("info", "⚠️ LaTeX compilation failed. Attempting a targeted repair of the failing lines...")
+
+            with trace.span("repair") as span:
+                def generate_repair(repair_prompt_parts):
+                    repair_response = generate_with_backoff(model, repair_prompt_parts, self.rate_limit_retries, stream=False)
+                    span["prompt_tokens"], span["output_tokens"] = token_usage(repair_response)
+                    return response_text(repair_response)
+
+                repair = attempt_targeted_repair(tex_code, result.log, generate_repair, self.compile_engine.compile)
+                span["succeeded"] = bool(repair and repair.result.succeeded)
+            if repair and repair.result.succeeded:
+                tex_code, result = repair.tex_code, repair.result
+                emit("toast", f"Fixed {len(repair.errors)} compile error(s) with a targeted repair.")
+        return tex_code, result
+
+    def check_layout(self, tex_code: str, compiled: CompileResult, request: GenerationRequest, on_event=None,
+                     trace=NULL_TRACE):
+        """Analyze the compiled PDF without rendering it; tighten spacing on a small page overflow.
+
+        Returns (tex_code, CompileResult, LayoutReport).
+        """
+        emit = on_event or (lambda kind, message: None)
+        with trace.span("layout") as span:
+            report = analyze_layout(compiled.pdf_bytes, compiled.log)
+            span["pages"] = report.page_count
+        if report.spills_over(request.max_pages):
+            with trace.span("tighten") as span:
+                tightened = tighten_to_fit(tex_code, report, self.compile_engine.compile, request.max_pages)
+                span["succeeded"] = tightened is not None
+            if tightened:
+                tex_code, compiled, report = tightened
+                emit("toast", f"Tightened spacing to fit on {request.max_pages} page(s).")
+            else:
+                emit("warning", f"⚠️ The resume runs to {report.page_count} pages (limit: {request.max_pages}).")
+        return tex_code, compiled, report
+
+    def cleanup(self, uploaded_file, on_event=None, api_key: Optional[str] = None):
+        """Delete the instructions PDF from Gemini, in the background when there is a janitor."""
+        emit = on_event or (lambda kind, message: None)
+        if not uploaded_file:
+            return
+        if self.janitor is not None:
+            self.janitor.delete_remote_file(uploaded_file.name, api_key)
+            return
+        try:
+            emit("info", f"Cleaning up file '{uploaded_file.display_name}' on Gemini...")
+            with using_key(api_key):
+                genai.delete_file(uploaded_file.name)
+            emit("toast", "Gemini file cleanup done.")
+        except Exception as cleanup_err:
+            emit("warning", f"⚠️ Could not delete the file from Gemini: {cleanup_err}")
+
+    def page_count(self, pdf_bytes: bytes) -> int:
+        return self.preview_cache.page_count(pdf_bytes)
+
+    def preview_page(self, pdf_bytes: bytes, page_num: int, dpi: int) -> bytes:
+        """PNG bytes for one page of a compiled resume."""
+        start = time.perf_counter()
+        img_bytes = self.preview_cache.render_page(pdf_bytes, page_num, dpi)
+        self.metrics.observe("preview_render", time.perf_counter() - start)
+        return img_bytes
+
+    def export(self, pdf_bytes: bytes, job_description: str = "") -> ExportBundle:
+        """Text, Markdown, thumbnail and ATS keyword match for a compiled resume.
+
+        The PDF is opened once per distinct PDF; the thumbnail also seeds the
+        preview cache, so the default preview is not rendered again.
+        """
+        start = time.perf_counter()
+        artifacts, built = self.export_cache.get_or_build(pdf_bytes)
+        if built:
+            self.metrics.observe("export", time.perf_counter() - start)
+            if self.preview_cache is not None and artifacts.thumbnail_png:
+                self.preview_cache.store(artifacts.digest, 0, THUMBNAIL_DPI, artifacts.thumbnail_png, artifacts.page_count)
+        return ExportBundle(artifacts, ats_match(artifacts.text, job_description))
+
+    # --- Driver ---
+
+    def run(self, request: GenerationRequest, api_key: Optional[str] = None, stream=False,
+            on_text: Optional[Callable[[str], None]] = None, on_event=None) -> GenerationResult:
+        """Run every stage with up to `max_attempts` full regenerations.
+
+        Without `api_key`, the run leases a key from the key pool (if any); a
+        run that hits a 429 or a rejected key is retried once per pooled key.
+        Gemini API errors (PermissionDenied, ResourceExhausted, ...) propagate to
+        the caller, which owns API key handling.
+        """
+        if api_key or self.key_pool is None:
+            return self._run(request, api_key, stream, on_text, on_event)
+
+        emit = on_event or (lambda kind, message: None)
+        for pool_attempt in range(len(self.key_pool)):
+            last_try = pool_attempt + 1 == len(self.key_pool)
+            with self.key_pool.lease() as lease:
+                try:
+                    return self._run(request, lease.api_key, stream, on_text, on_event, lease)
+                except google_exceptions.ResourceExhausted:
+                    lease.rate_limited()
+                    if last_try:
+                        raise
+                    emit("warning", f"⚠️ Rate limited on {lease.label}; retrying on another API key...")
+                except google_exceptions.PermissionDenied:
+                    lease.invalid()
+                    if last_try:
+                        raise
+                    emit("warning", f"⚠️ {lease.label} was rejected; retrying on another API key...")
+
+    def _run(self, request: GenerationRequest, api_key: Optional[str], stream, on_text, on_event,
+             lease=None) -> GenerationResult:
+        emit = on_event or (lambda kind, message: None)
+        # Every Gemini call runs on this run's key and is charged to the lease
+        model = KeyedModel(self.model_factory(self.model_name), api_key, lease)
+
+        trace = self.metrics.start_run()
+        if lease is not None:
+            trace.set(api_key=lease.label, key_tokens_left=round(lease.tokens_left, 2))
+        mismatch = self.section_mismatch(request)
+        if mismatch:
+            emit("warning", f"⚠️ Could not match {', '.join(mismatch)} to the previous output (renamed sections?); "
+                            "regenerating the whole document instead.")
+        result = GenerationResult(run_id=trace.run_id, compaction=self.compaction_report(request))
+        if result.compaction is not None:
+            trace.set(estimated_tokens_saved=result.compaction.saved_tokens)
+            emit("toast", f"Prompt compacted: ~{result.compaction.saved_tokens} fewer input tokens "
+                          f"({result.compaction.saved_ratio:.0%}).")
+        uploaded = {} # Remote instructions PDF, resolved at most once per run
+        last_error = None
+        tokens = {"prompt_tokens": 0, "output_tokens": 0}
+        outcome = "error" # Replaced once the attempt loop finishes without raising
+
+        def get_uploaded_file():
+            if request.instructions_pdf and "file" not in uploaded:
+                emit("info", f"Preparing '{request.instructions_pdf_name}' for Gemini...")
+                with trace.span("upload") as span:
+                    uploaded["file"], uploaded["owned"] = self.upload_instructions(request, api_key, on_event)
+                    span["reused"] = not uploaded["owned"] and self.file_registry is not None
+            return uploaded.get("file")
+
+        try:
+            for attempt in range(self.max_attempts):
+                result.attempts = attempt + 1
+                # The error log's line numbers refer to the full document, so retries send it uncompacted
+                attempt_request = replace(request, compact_prompt=False) if last_error else request
+                prompt_parts = self.build_prompt(attempt_request, last_error)
+
+                emit("info", f"Attempt {attempt + 1}: Generating improved LaTeX code{' and summary' if request.summary_requested else ''}...")
+                # Speculative candidates only on the first attempt; retries carry the error context instead
+                candidates = request.candidates if attempt == 0 else 1
+                if candidates > 1:
+                    emit("info", f"Attempt 1: Generating {candidates} candidates in parallel; the first that compiles wins...")
+                response = self.call_model(model, prompt_parts, attempt_request, get_uploaded_file, stream, on_text,
+                                           trace, candidates)
+                tokens["prompt_tokens"] += response.prompt_tokens
+                tokens["output_tokens"] += response.output_tokens
+                if response.from_cache:
+                    emit("info", f"Attempt {attempt + 1}: Reusing cached Gemini response for identical inputs.")
+                    emit("toast", "Served from generation cache.")
+
+                if not response.text:
+                    result.error = f"Gemini did not return text content. Finish reason: {response.prompt_feedback}"
+                    break
+
+                with trace.span("parse"):
+                    tex_code, change_summary, summary_missing = self.parse(response, attempt_request, on_event)
+                tex_code, compiled = self.compile(model, tex_code, response, on_event, trace)
+                self.remember(response, compiled)
+                result.tex_code = tex_code
+                result.compile_result = compiled
+
+                if compiled.succeeded:
+                    tex_code, compiled, result.layout = self.check_layout(tex_code, compiled, request, on_event, trace)
+                    result.tex_code = tex_code
+                    result.compile_result = compiled
+                    result.pdf_bytes = compiled.pdf_bytes
+                    result.change_summary = change_summary
+                    result.summary_missing = summary_missing
+                    result.error = None
+                    break
+
+                last_error = compiled.error_report()
+                result.error = "LaTeX compilation failed."
+                if attempt + 1 < self.max_attempts:
+                    emit("warning", f"⚠️ LaTeX compilation failed. Retrying with error context... (Attempt {attempt + 1}/{self.max_attempts})")
+                    with trace.span("retry_sleep"):
+                        time.sleep(self.retry_delay)
+            outcome = "success" if result.succeeded else "failed"
+        finally:
+            # Registry-managed files outlive the run; only per-run uploads are deleted
+            if uploaded.get("owned"):
+                with trace.span("cleanup"):
+                    self.cleanup(uploaded["file"], on_event, api_key)
+            # Targeted-repair tokens are recorded on their spans; count them in the totals too
+            for stage in trace.stages:
+                if stage["stage"] == "repair":
+                    tokens["prompt_tokens"] += stage.get("prompt_tokens", 0)
+                    tokens["output_tokens"] += stage.get("output_tokens", 0)
+            trace.set(attempts=result.attempts, **tokens)
+            trace.finish(outcome)
+        return result
@@ -0,0 +1,100 @@
+MODEL_NAME = 'gemini-2.5-pro-exp-03-25'
+
+# Stands in for the uploaded Gemini file until it is actually needed, so the
+# prompt (and its cache key) can be built before any upload happens.
+INSTRUCTIONS_PDF_PLACEHOLDER = object()
+
+
+def build_prompt_parts(current_tex_code, job_description, summary_requested, instructions_pdf=None, last_error=None):
+    """Construct the Gemini prompt. Pass `last_error` on retries to include the compile log."""
+    # --- Construct the Prompt --- (Conditionally add summary instructions)
+    if instructions_pdf is not None:
+        # Use PDF-based prompt
+        prompt_parts = [
+            "You are an expert LaTeX resume editor specializing in ATS-friendly resumes tailored for specific job descriptions.",
+            "You will be given the current LaTeX code for a resume, a PDF file with improvement feedback, and a target job description.",
+            "\n**Task:** Analyze the instructions in the PDF and the requirements in the job description. Apply relevant improvements to the given LaTeX code to create an optimized, ATS-friendly version tailored for the target role.",
+            "\n**Input Resume LaTeX Code:**\n```latex\n",
+            current_tex_code,
+            "\n```\n",
+            "\n**Input Instructions PDF:**\n",
+            instructions_pdf,
+        ]
+    else:
+        # Use general instructions prompt
+        prompt_parts = [
+            "You are an expert resume optimizer specializing in tailoring resumes to pass Applicant Tracking Systems (ATS) and appeal to recruiters.",
+            "Your task is to revise the provided resume based on the job description. Follow these instructions precisely:",
+            "\n**Input Resume LaTeX Code:**\n```latex\n",
+            current_tex_code,
+            "\n```\n",
+            "\n**Target Job Description:**\n```text\n",
+            job_description,
+            "\n```\n",
+            "\n**Instructions:**",
+            "1. ATS Compliance & Searchability:",
+            "- Ensure contact information is easily parsable (Name, Phone, Email, LinkedIn URL if available).",
+            "- Find and incorporate the exact job title from the job description.",
+            "- Include a concise summary/objective section highlighting relevant qualifications.",
+            "- Verify presence of standard sections (Work Experience, Education) with clear headings.",
+            "- Match education requirements if specified in the job description.",
+            "- Use consistent date formatting (MM/YYYY or Month YYYY).",
+            "2. Skills Integration:",
+            "- Identify and incorporate hard skills from the job description using exact wording.",
+            "- Weave soft skills naturally into work experience and summary.",
+            "3. Content & Recruiter Appeal:",
+            "- Include quantifiable achievements and results in bullet points.",
+            "- Maintain professional, positive, and action-oriented language.",
+            "- Keep content concise and under 1000 words for non-executive roles.",
+            "- Ensure experience level matches job requirements.",
+            "4. Formatting:",
+            "- Avoid columns, tables, or images that can confuse ATS.",
+            "- Keep bullet points and paragraphs concise (under 40 words).",
+            "- Use standard, readable fonts.",
+            "- Avoid information in headers/footers.",
+        ]
+
+    # Define Output Requirements based on checkbox
+    output_reqs = [
+        "\n**Output Requirements:**",
+        "- Output ONLY the complete, modified LaTeX code for the improved resume.",
+        "- Ensure the LaTeX output is valid and compilable.",
+        "- Tailor content/keywords to the job description.",
+        "- Do NOT include any conversational text, explanations, or introductions/conclusions outside the LaTeX code itself.",
+        "- Use comments within LaTeX (e.g., `% Gemini: Applied suggestion X / Tailored for JD keyword Y`) if helpful.",
+    ]
+    if summary_requested:
+        output_reqs.insert(2, "1a. After the LaTeX code block, add a separator line exactly like this: `--- SUMMARY ---`")
+        output_reqs.insert(3, "1b. After the separator, provide a brief bulleted list summarizing the key changes made based on the feedback PDF and job description (if provided). Mention specific keywords tailored if applicable.")
+        # Adjust numbering/phrasing if needed, but main point is conditional inclusion
+        output_reqs[-2] = "- Do NOT include any conversational text, explanations, or introductions/conclusions outside the LaTeX code itself OR the summary section."
+
+    formatting_reqs = [
+        "\n**Formatting Requirements:**",
+        "- Maintain ATS compatibility (standard commands, avoid complex formatting).",
+        "- Ensure excellent readability with appropriate vertical spacing (`\\vspace`, `\\itemsep`, etc.).",
+        "- Use standard fonts and maintain clear document hierarchy.",
+    ]
+
+    prompt_parts.extend(output_reqs)
+    prompt_parts.extend(formatting_reqs)
+
+    # Add error context if this is a retry (Conditionally mention summary)
+    if last_error:
+        error_prompt_addition = [
+            "\n**Previous Attempt Error:**",
+            "The previous LaTeX code failed to compile. Here are the error logs:",
+            "```text",
+            last_error,
+            "```",
+        ]
+        if summary_requested:
+            error_prompt_addition[-1] += " Remember to output the corrected LaTeX code followed by `--- SUMMARY ---` and a summary of changes."
+        prompt_parts.extend(error_prompt_addition)
+
+    return prompt_parts
+
+
+def resolve_instructions_pdf(prompt_parts, uploaded_gemini_file):
+    """Swap the instructions placeholder for the real uploaded Gemini file."""
+    return [uploaded_gemini_file if part is INSTRUCTIONS_PDF_PLACEHOLDER else part for part in prompt_parts]
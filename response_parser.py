@@ -0,0 +1,34 @@
+SUMMARY_SEPARATOR = "--- SUMMARY ---"
+END_DOCUMENT = "\\end{document}"
+
+
+def strip_code_fences(tex_code):
+    """Clean potential markdown code block formatting from the LaTeX part."""
+    tex_code = tex_code.strip()
+    if tex_code.startswith("```latex"):
+        tex_code = tex_code[len("```latex"):].strip()
+    if tex_code.endswith("```"):
+        tex_code = tex_code[:-len("```")].strip()
+    return tex_code
+
+
+def parse_response(full_response_text, summary_requested):
+    """Split a Gemini response into (improved_tex_code, change_summary).
+
+    The summary is None unless it was requested and the separator is present.
+    """
+    improved_tex_code = full_response_text # Assume full response is LaTeX initially
+    change_summary = None
+    if summary_requested and SUMMARY_SEPARATOR in full_response_text:
+        parts = full_response_text.split(SUMMARY_SEPARATOR, 1)
+        improved_tex_code = parts[0].strip()
+        change_summary = parts[1].strip()
+    return strip_code_fences(improved_tex_code), change_summary
+
+
+def complete_latex_block(partial_text):
+    """Return the LaTeX document from a partial response once `\\end{document}` has arrived, else None."""
+    index = partial_text.find(END_DOCUMENT)
+    if index == -1:
+        return None
+    return strip_code_fences(partial_text[:index + len(END_DOCUMENT)])
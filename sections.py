@@ -0,0 +1,212 @@
+"""Split a LaTeX resume into sections so only changed or selected ones are regenerated.
+
+A document is split into ordered blocks: the preamble (through
+`\\begin{document}`), the header (contact block before the first section),
+one block per `\\section{...}`, and the trailer (`\\end{document}` onwards).
+Each block has a stable key and a content hash, so two versions of a resume
+can be diffed section by section and regenerated sections spliced back into
+the previously improved document.
+"""
+import difflib
+import hashlib
+import re
+from dataclasses import dataclass
+
+from response_parser import SUMMARY_SEPARATOR, END_DOCUMENT
+
+PREAMBLE = "preamble"
+HEADER = "header"
+TRAILER = "trailer"
+BEGIN_DOCUMENT = "\\begin{document}"
+MATCH_RATIO = 0.4 # Minimum title or content similarity for a renamed section to count as the same one
+
+_SECTION_LINE = re.compile(r"^[ \t]*\\section\*?\{([^}]*)\}", re.MULTILINE)
+_MACRO_DEFINITION = re.compile(r"^[ \t]*\\(?:re)?newcommand\*?\{?(\\[A-Za-z@]+)\}?(\[\d\])?", re.MULTILINE)
+# The last block may lack its closing fence (e.g. a truncated response)
+_SECTION_BLOCK = re.compile(r"^### SECTION (.+?)[ \t]*\n```(?:latex)?[ \t]*\n(.*?)\n?(?:```|\Z)", re.MULTILINE | re.DOTALL)
+
+
+@dataclass
+class Section:
+    key: str
+    text: str
+
+    @property
+    def digest(self):
+        return hashlib.sha256(self.text.strip().encode("utf-8")).hexdigest()
+
+
+def split_sections(tex_code):
+    """Ordered Sections of `tex_code`. Returns [] when there is no `\\begin{document}`."""
+    begin = tex_code.find(BEGIN_DOCUMENT)
+    if begin == -1:
+        return []
+    body_start = begin + len(BEGIN_DOCUMENT)
+    end = tex_code.find(END_DOCUMENT, body_start)
+    if end == -1:
+        end = len(tex_code)
+
+    sections = [Section(PREAMBLE, tex_code[:body_start])]
+    body = tex_code[body_start:end]
+    starts = [match.start() for match in _SECTION_LINE.finditer(body)]
+    sections.append(Section(HEADER, body[:starts[0]] if starts else body))
+    seen = {}
+    for index, start in enumerate(starts):
+        stop = starts[index + 1] if index + 1 < len(starts) else len(body)
+        title = _SECTION_LINE.match(body, start).group(1).strip() or "Untitled"
+        # Repeated titles get a counter so keys stay unique
+        seen[title] = seen.get(title, 0) + 1
+        key = title if seen[title] == 1 else f"{title} ({seen[title]})"
+        sections.append(Section(key, body[start:stop]))
+    sections.append(Section(TRAILER, tex_code[end:]))
+    return sections
+
+
+def join_sections(sections):
+    return "".join(section.text for section in sections)
+
+
+def section_keys(tex_code, include_fixed=False):
+    """Keys of the regenerable sections (header and `\\section`s; also preamble/trailer if `include_fixed`)."""
+    return [
+        section.key for section in split_sections(tex_code)
+        if include_fixed or section.key not in (PREAMBLE, TRAILER)
+    ]
+
+
+def changed_sections(old_tex, new_tex):
+    """Keys of `new_tex` whose content differs from (or is missing in) `old_tex`, in document order."""
+    old = {section.key: section.digest for section in split_sections(old_tex)}
+    return [
+        section.key for section in split_sections(new_tex)
+        if section.key != TRAILER and old.get(section.key) != section.digest
+    ]
+
+
+def macro_signatures(preamble):
+    """Custom macros defined in the preamble, e.g. `\\resumeItem[1]`, so Gemini can use them without the preamble."""
+    return [name + (args or "") for name, args in _MACRO_DEFINITION.findall(preamble)]
+
+
+def build_section_prompt_parts(sections, job_description, summary_requested, macros=(), last_error=None):
+    """Prompt asking Gemini to improve only `sections` (a list of Section) for the job description."""
+    prompt_parts = [
+        "You are an expert resume optimizer specializing in tailoring resumes to pass Applicant Tracking Systems (ATS) and appeal to recruiters.",
+        "You will be given SOME sections of a LaTeX resume, not the whole document. Revise only these sections for the job description below.",
+        "\n**Target Job Description:**\n```text\n",
+        job_description,
+        "\n```\n",
+    ]
+    if macros:
+        prompt_parts.append("\n**Custom macros available (defined in the preamble, do not redefine):** " + ", ".join(macros))
+    prompt_parts.append("\n**Sections:**")
+    for section in sections:
+        prompt_parts.append(f"### SECTION {section.key}\n```latex\n{section.text.strip()}\n```")
+    prompt_parts.extend([
+        "\n**Output Requirements:**",
+        "- For every section, output its header line (e.g. `### SECTION Experience`) exactly as given, followed by a ```latex block containing the improved LaTeX for that section only.",
+        "- Keep each section's `\\section{...}` line. Use exact keywords from the job description and quantifiable achievements; keep bullet points concise.",
+        "- The LaTeX must compile inside the existing document: no preamble, no `\\begin{document}`/`\\end{document}`.",
+        "- Do NOT output any other text.",
+    ])
+    if summary_requested:
+        prompt_parts.append(f"- After the last section, add a line exactly like this: `{SUMMARY_SEPARATOR}` followed by a brief bulleted list summarizing the key changes.")
+    if last_error:
+        prompt_parts.extend([
+            "\n**Previous Attempt Error:**",
+            "The document with your previous sections failed to compile. Here are the error logs:",
+            "```text",
+            last_error,
+            "```",
+        ])
+    return prompt_parts
+
+
+def parse_section_response(response_text, keys):
+    """Return {key: latex} for the requested sections Gemini sent back. Unknown keys are ignored."""
+    allowed = set(keys)
+    replacements = {}
+    for match in _SECTION_BLOCK.finditer(response_text or ""):
+        key = match.group(1).strip()
+        if key in allowed:
+            replacements[key] = "\n" + match.group(2).strip("\n") + "\n"
+    return replacements
+
+
+def _similarity(section, other):
+    titles = difflib.SequenceMatcher(None, section.key.lower(), other.key.lower()).ratio()
+    texts = difflib.SequenceMatcher(None, section.text.strip(), other.text.strip()).ratio()
+    return max(titles, texts)
+
+
+def match_sections(current_tex, improved_tex):
+    """Map each section key of `current_tex` to its counterpart in `improved_tex`, or None if it has none.
+
+    Keys present in both match directly. A section the improved document
+    renamed (e.g. "Summary" -> "Professional Summary") is matched to the
+    most similar unclaimed section between the same matched neighbours.
+    """
+    current = split_sections(current_tex)
+    improved = split_sections(improved_tex)
+    improved_index = {section.key: index for index, section in enumerate(improved)}
+    mapping = {section.key: (section.key if section.key in improved_index else None) for section in current}
+    claimed = {key for key in mapping.values() if key is not None}
+    for index, section in enumerate(current):
+        if mapping[section.key] is not None:
+            continue
+        low = max((improved_index[mapping[s.key]] for s in current[:index] if mapping[s.key]), default=-1)
+        high = min((improved_index[mapping[s.key]] for s in current[index + 1:] if mapping[s.key]), default=len(improved))
+        candidates = [other for other in improved[low + 1:high] if other.key not in claimed]
+        if candidates:
+            best = max(candidates, key=lambda other: _similarity(section, other))
+            if _similarity(section, best) >= MATCH_RATIO:
+                mapping[section.key] = best.key
+                claimed.add(best.key)
+    return mapping
+
+
+def unmatched_sections(current_tex, improved_tex, keys):
+    """Keys that cannot be spliced safely: no counterpart while the improved document has unclaimed sections.
+
+    A section that is simply new is inserted; but if the improved document
+    also has sections nothing maps to, the key may be one of them renamed
+    beyond recognition, and splicing would keep both.
+    """
+    mapping = match_sections(current_tex, improved_tex)
+    claimed = set(mapping.values())
+    if all(section.key in claimed for section in split_sections(improved_tex)):
+        return []
+    return [key for key in keys if key in mapping and mapping[key] is None]
+
+
+def splice_sections(improved_tex, current_tex, replacements):
+    """Rebuild the improved document with regenerated sections.
+
+    `replacements` maps keys of `current_tex` to new LaTeX; each replaces
+    its counterpart from `match_sections`, so a section the improved
+    document renamed is replaced rather than duplicated. Keys without a
+    counterpart are inserted after the section that precedes them in
+    `current_tex`. The improved document's preamble is kept.
+    """
+    result = split_sections(improved_tex)
+    mapping = match_sections(current_tex, improved_tex)
+    current_order = list(mapping)
+    targets = {mapping.get(key): text for key, text in replacements.items() if mapping.get(key)}
+    for section in result:
+        if section.key in targets:
+            section.text = targets[section.key]
+
+    for key, text in replacements.items():
+        if mapping.get(key):
+            continue
+        position = len(result) - 1 if result and result[-1].key == TRAILER else len(result)
+        if key in current_order:
+            # After the counterpart of the nearest preceding section that exists in the improved document
+            for previous_key in reversed(current_order[:current_order.index(key)]):
+                indexes = [index for index, section in enumerate(result) if section.key == mapping[previous_key]]
+                if mapping[previous_key] and indexes:
+                    position = indexes[0] + 1
+                    break
+        result.insert(position, Section(key, text))
+        mapping[key] = key
+    return join_sections(result)
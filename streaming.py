@@ -0,0 +1,29 @@
+from response_parser import complete_latex_block
+
+
+def stream_response(response, on_text=None, on_latex_complete=None):
+    """Consume a streamed `generate_content` response and return the full text.
+
+    `on_text(text_so_far)` is called after every chunk. `on_latex_complete(tex_code)`
+    is called once, as soon as the LaTeX document is complete, so compilation can
+    start while the rest of the response (e.g. the summary) is still arriving.
+    """
+    full_text = ""
+    latex_done = False
+    for chunk in response:
+        try:
+            chunk_text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. a final chunk carrying only the finish reason)
+            continue
+        if not chunk_text:
+            continue
+        full_text += chunk_text
+        if on_text is not None:
+            on_text(full_text)
+        if not latex_done and on_latex_complete is not None:
+            tex_code = complete_latex_block(full_text)
+            if tex_code is not None:
+                latex_done = True
+                on_latex_complete(tex_code)
+    return full_text